@@ -0,0 +1,253 @@
+#!/usr/bin/python
+
+"""
+Calling the agents, either in the sim's own process or spread over a pool
+of worker processes.
+
+Within a round, each peer's requests() only depends on the round's
+PeerInfo snapshot and its own history, and each uploads() on the requests
+routed to it, so the calls can run side by side.  An AgentPool starts
+worker processes that each own a fixed shard of the agents for the whole
+run, plus a replica of the swarm state and History that they keep current
+from each round's transfer delta.  The sim only exchanges compact
+per-round data with them:
+
+  to the workers:   the last round's delta and Uploads, then the Requests
+                    routed to each of their peers
+  from the workers: each of their peers' Requests, then Uploads (and,
+                    with time budgets on, how long each peer took)
+
+Validation and transfer resolution stay with the sim.  Agents that draw
+from their own self.rng behave exactly as they do in the sim's process.
+"""
+
+import logging
+import traceback
+import cPickle
+import multiprocessing
+
+from messages import PeerInfo, RoundChanges
+from engine import Engine
+from budget import DecisionClock, budgets_on
+from util import make_agent
+
+
+def round_changes(peer_history, new_pieces):
+    """The RoundChanges for a delta agent, from the engine's new_pieces."""
+    round = peer_history.current_round()
+    downloads = []
+    if round > 0:
+        downloads = peer_history.downloads[-1]
+    return RoundChanges(round, new_pieces, downloads, peer_history)
+
+
+def get_requests(p, peer_info, peer_history, state, new_pieces, clock=None):
+    """
+    Hand p a copy of its pieces and ask it for this round's Requests.  With
+    a DecisionClock, the call is timed and held to the round's budget.
+
+    Agents on the original interface get peer_info minus themselves; delta
+    agents get a RoundChanges built from new_pieces instead, which is kept
+    as p.changes for their uploads_delta() call.
+    """
+    def remove_me(info):
+        # TODO: Do we need this linear pass?
+        return filter(lambda peer: peer.id != p.id, peer_info)
+
+    pieces = state.pieces(p.id)
+    # Made copy of pieces and the peer info this peer needs to make it's
+    # decision, so that it can't change the simulation's copies.
+    p.update_pieces(pieces)
+    if p.api_version >= 2:
+        p.changes = round_changes(peer_history, new_pieces)
+        f = lambda: p.requests_delta(p.changes)
+    else:
+        others = remove_me(peer_info)
+        f = lambda: p.requests(others, peer_history)
+    if clock is None:
+        return f()
+    return clock.call(p.id, "requests", f)
+
+
+def get_uploads(p, requests, peer_info, peer_history, clock=None):
+    """requests: just the Requests addressed to p this round"""
+    def remove_me(info):
+        # TODO: remove this pass?  Use a set?
+        return filter(lambda peer: peer.id != p.id, peer_info)
+
+    if p.api_version >= 2:
+        f = lambda: p.uploads_delta(requests, p.changes)
+    else:
+        others = remove_me(peer_info)
+        f = lambda: p.uploads(requests, others, peer_history)
+    if clock is None:
+        return f()
+    return clock.call(p.id, "uploads", f)
+
+
+class AgentFailure:
+    """An exception raised by an agent in a worker, with its traceback."""
+    def __init__(self, exc, tb):
+        try:
+            cPickle.dumps(exc, cPickle.HIGHEST_PROTOCOL)
+        except Exception:
+            exc = RuntimeError(repr(exc))
+        self.exc = exc
+        self.tb = tb
+
+
+def _worker(conn, conf, peer_ids, upload_rates, specs):
+    """
+    Worker process main loop.  specs: [(class_name, constructor params,
+    random stream)] for this worker's agents.
+    """
+    engine = Engine(conf, peer_ids, upload_rates)
+    state = engine.state
+    history = engine.history
+    agents = [make_agent(conf.agent_classes[name], params, rng)
+              for (name, params, rng) in specs]
+    peer_info = None
+    h = dict()
+    clock = None
+    if budgets_on(conf):
+        clock = DecisionClock(conf.hard_budget)
+
+    def call_each(f):
+        """[(peer_id, result)] in shard order, stopping at the first agent
+        that raises."""
+        results = []
+        for p in agents:
+            try:
+                results.append((p.id, f(p)))
+            except Exception, e:
+                results.append((p.id, AgentFailure(e, traceback.format_exc())))
+                break
+        return results
+
+    while True:
+        msg = conn.recv()
+        if msg[0] == "requests":
+            (round, update) = msg[1:]
+            if update is not None:
+                (last_round, delta, uploads) = update
+                downloads = engine.apply_delta(peer_ids, delta)
+                history.update(downloads, uploads)
+                engine.record_done(last_round)
+            peer_info = [PeerInfo(pid, state.available_bits(pid))
+                         for pid in peer_ids]
+            for p in agents:
+                h[p.id] = history.peer_history(p.id)
+            if clock is not None:
+                clock.start_round()
+            conn.send(call_each(
+                lambda p: get_requests(p, peer_info, h[p.id], state,
+                                       engine.new_pieces, clock)))
+        elif msg[0] == "uploads":
+            requests_to = msg[1]
+            results = call_each(
+                lambda p: get_uploads(p, requests_to[p.id], peer_info,
+                                      h[p.id], clock))
+            timing = None
+            if clock is not None:
+                timing = (clock.spent, clock.overran)
+            conn.send((results, timing))
+        elif msg[0] == "stop":
+            break
+    conn.close()
+
+
+class AgentPool:
+    """
+    The sim's handle on the worker processes.  Peers are dealt out to the
+    workers round-robin, in peer order.
+    """
+    def __init__(self, conf, peer_ids, upload_rates, specs, workers):
+        """
+        specs: [(class_name, constructor params, random stream)], one per
+        peer, in order
+        """
+        self.peer_ids = peer_ids[:]
+        n = min(workers, len(peer_ids))
+        self.shards = [peer_ids[k::n] for k in range(n)]
+        self.conns = []
+        self.procs = []
+        for k in range(n):
+            (parent, child) = multiprocessing.Pipe()
+            proc = multiprocessing.Process(
+                target=_worker,
+                args=(child, conf, peer_ids, upload_rates, specs[k::n]))
+            proc.daemon = True
+            proc.start()
+            child.close()
+            self.conns.append(parent)
+            self.procs.append(proc)
+        self.update = None
+        # The last uploads() round's DecisionClock data, if budgets are on
+        self.spent = dict()
+        self.overran = dict()
+
+    def _exchange(self, msgs):
+        """Send each worker its message; returns their replies in order."""
+        for (conn, msg) in zip(self.conns, msgs):
+            conn.send(msg)
+        return [conn.recv() for conn in self.conns]
+
+    def requests(self, round):
+        """
+        Ask every agent for its Requests.  Returns dict: peer_id -> list of
+        Requests, or an AgentFailure (see result()).
+        """
+        update = self.update
+        self.update = None
+        results = dict()
+        for r in self._exchange([("requests", round, update)] *
+                                len(self.conns)):
+            results.update(r)
+        return results
+
+    def uploads(self, requests_to):
+        """
+        requests_to: dict : peer_id -> Requests addressed to that peer.
+        Returns dict: peer_id -> list of Uploads, or an AgentFailure.  With
+        time budgets on, also sets self.spent and self.overran for the
+        round, as a DecisionClock would.
+        """
+        results = dict()
+        self.spent = dict()
+        self.overran = dict()
+        for (r, timing) in self._exchange(
+            [("uploads", dict((pid, requests_to[pid]) for pid in shard))
+             for shard in self.shards]):
+            results.update(r)
+            if timing is not None:
+                self.spent.update(timing[0])
+                self.overran.update(timing[1])
+        return results
+
+    def end_round(self, round, delta, uploads):
+        """Pass the round's outcome on to the workers with the next
+        requests() call."""
+        self.update = (round, delta, uploads)
+
+    def result(self, results, peer_id):
+        """
+        peer_id's entry in requests() or uploads() results.  If the agent
+        raised, raise its exception here.  Peers later in a failed agent's
+        shard have no entry, but callers walking the peers in order stop
+        at the failure first.
+        """
+        r = results[peer_id]
+        if isinstance(r, AgentFailure):
+            logging.error("Agent %s failed in a worker process:\n%s",
+                          peer_id, r.tb)
+            raise r.exc
+        return r
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(("stop",))
+            except (IOError, EOFError):
+                pass
+        for proc in self.procs:
+            proc.join()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+
+"""
+Scale benchmark for the simulator core.
+
+Runs Sim.run_sim_once over a matrix of swarm sizes, piece counts and
+agent mixes, for a fixed number of rounds each, and records per cell:
+
+  wall_per_round, cpu_per_round   seconds, best of --repeat runs
+  peak_rss_kb                     peak resident set size of the process
+  rss_growth_kb                   how much the run itself raised the peak
+                                  RSS -- the closest thing to peak
+                                  allocations Python 2 can measure, since
+                                  it has no allocation tracer
+  gc_objects                      objects tracked by the garbage collector
+                                  at the end of the run
+
+Every run happens in a fresh process, so memory numbers don't carry over
+from one cell to the next.  The mixes are all Dummy, all BoomerStd, or
+half and half, with one Seed per ten peers (at least one).
+
+  bench.py --save FILE          run the matrix and write a JSON baseline
+  bench.py --compare FILE       rerun the baseline's cells and flag any
+                                metric more than --threshold worse
+
+Usage: bench.py [options]
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import logging
+import platform
+import resource
+import multiprocessing
+from optparse import OptionParser
+
+import sim
+import sweep
+
+MIXES = ["dummy", "std", "mixed"]
+
+# Metrics compared against a baseline; for all of them, lower is better.
+METRICS = ["wall_per_round", "cpu_per_round", "peak_rss_kb", "rss_growth_kb",
+           "gc_objects"]
+
+
+def population(mix, peers):
+    """The agents string for a mix of `peers` peers, seeds included."""
+    seeds = max(1, peers // 10)
+    rest = peers - seeds
+    if mix == "dummy":
+        groups = [("Dummy", rest)]
+    elif mix == "std":
+        groups = [("BoomerStd", rest)]
+    elif mix == "mixed":
+        groups = [("Dummy", rest - rest // 2), ("BoomerStd", rest // 2)]
+    else:
+        raise ValueError("Unknown mix: %s" % mix)
+    groups.append(("Seed", seeds))
+    return " ".join("%s,%d" % (c, n) for (c, n) in groups if n > 0)
+
+
+def cell_key(mix, peers, pieces):
+    return "%s/peers=%d/pieces=%d" % (mix, peers, pieces)
+
+
+def run_cell(args):
+    """One run of one cell, meant for a fresh worker process."""
+    (mix, peers, pieces, rounds, seed) = args
+    # Agents like Dummy print as they start up; keep the report readable.
+    sys.stdout = open(os.devnull, "w")
+    logging.getLogger().setLevel(logging.CRITICAL)
+    config = sweep.make_config(sim.option_parser(),
+                               {"agents": population(mix, peers),
+                                "num_pieces": pieces,
+                                "max_round": rounds - 1},
+                               seed)
+    gc.collect()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    (wall, cpu) = (time.time(), time.clock())
+    history = sim.Sim(config).run_sim_once()
+    (wall, cpu) = (time.time() - wall, time.clock() - cpu)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    n = max(history.num_rounds, 1)
+    return {"rounds": history.num_rounds,
+            "wall_per_round": wall / n,
+            "cpu_per_round": cpu / n,
+            "peak_rss_kb": rss,
+            "rss_growth_kb": rss - rss_before,
+            "gc_objects": len(gc.get_objects())}
+
+
+def measure(mix, peers, pieces, rounds, seed, repeat):
+    """Best (lowest) value of each metric over `repeat` runs."""
+    best = None
+    for r in range(repeat):
+        pool = multiprocessing.Pool(1)
+        try:
+            result = pool.apply(run_cell, ((mix, peers, pieces, rounds, seed),))
+        finally:
+            pool.close()
+            pool.join()
+        if best is None:
+            best = result
+        else:
+            for m in METRICS:
+                if m in result:
+                    best[m] = min(best[m], result[m])
+    best.update({"key": cell_key(mix, peers, pieces), "mix": mix,
+                 "peers": peers, "pieces": pieces})
+    return best
+
+
+def int_list(s):
+    return [int(x) for x in s.split(",") if x]
+
+
+def cell_str(c):
+    return ("%-32s %5d rounds  %9.4fs/round  %9d KB rss  %9d KB run  "
+            "%9d objects" % (c["key"], c["rounds"], c["wall_per_round"],
+                             c["peak_rss_kb"], c["rss_growth_kb"],
+                             c["gc_objects"]))
+
+
+def compare(baseline, cells, threshold):
+    """
+    Print how each cell's metrics moved against the baseline, and return
+    the regressions: [(key, metric, old, new)].
+    """
+    old_cells = dict((c["key"], c) for c in baseline["cells"])
+    regressions = []
+    print "%-32s %-15s %12s %12s %8s" % ("cell", "metric", "baseline", "now",
+                                         "change")
+    for c in cells:
+        old = old_cells[c["key"]]
+        for m in METRICS:
+            if m not in old or m not in c:
+                continue
+            if old[m]:
+                change = (c[m] - old[m]) / float(old[m])
+            else:
+                change = 0.0
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions.append((c["key"], m, old[m], c[m]))
+            print "%-32s %-15s %12.4f %12.4f %+7.1f%%%s" % (
+                c["key"], m, old[m], c[m], 100 * change, flag)
+    return regressions
+
+
+def main(args):
+    parser = OptionParser(usage="Usage: %prog [options]")
+    parser.add_option("--peers",
+                      dest="peers", default="10,100,1000",
+                      help="Comma-separated swarm sizes (up to 10000)")
+    parser.add_option("--pieces",
+                      dest="pieces", default="10,100,1000",
+                      help="Comma-separated piece counts (up to 10000)")
+    parser.add_option("--mixes",
+                      dest="mixes", default=",".join(MIXES),
+                      help="Comma-separated agent mixes: %s" % ", ".join(MIXES))
+    parser.add_option("--rounds",
+                      dest="rounds", default=3, type="int",
+                      help="Rounds to run in each cell")
+    parser.add_option("--repeat",
+                      dest="repeat", default=1, type="int",
+                      help="Runs per cell; the best of each metric is kept")
+    parser.add_option("--seed",
+                      dest="seed", default=0, type="int",
+                      help="Base seed for every cell")
+    parser.add_option("--save",
+                      dest="save", default=None,
+                      help="Write the results to this baseline file")
+    parser.add_option("--compare",
+                      dest="compare", default=None,
+                      help="Rerun the cells in this baseline file and flag "
+                      "regressions")
+    parser.add_option("--threshold",
+                      dest="threshold", default=0.10, type="float",
+                      help="Relative increase counted as a regression")
+    (options, args) = parser.parse_args(args[1:])
+    if options.rounds < 1 or options.repeat < 1:
+        parser.error("--rounds and --repeat must be >= 1")
+
+    baseline = None
+    if options.compare:
+        baseline = json.load(open(options.compare))
+        rounds = baseline["rounds"]
+        seed = baseline["seed"]
+        matrix = [(c["mix"], c["peers"], c["pieces"])
+                  for c in baseline["cells"]]
+    else:
+        rounds = options.rounds
+        seed = options.seed
+        mixes = [m for m in options.mixes.split(",") if m]
+        for m in mixes:
+            if m not in MIXES:
+                parser.error("Unknown mix: %s" % m)
+        matrix = [(mix, peers, pieces)
+                  for mix in mixes
+                  for peers in int_list(options.peers)
+                  for pieces in int_list(options.pieces)]
+
+    cells = []
+    for (mix, peers, pieces) in matrix:
+        c = measure(mix, peers, pieces, rounds, seed, options.repeat)
+        print cell_str(c)
+        sys.stdout.flush()
+        cells.append(c)
+
+    if options.save:
+        f = open(options.save, "w")
+        json.dump({"rounds": rounds, "seed": seed,
+                   "python": sys.version.split()[0],
+                   "platform": platform.platform(),
+                   "cells": cells}, f, indent=1, sort_keys=True)
+        f.close()
+        print "Baseline written to %s" % options.save
+
+    if baseline is not None:
+        print
+        regressions = compare(baseline, cells, options.threshold)
+        if regressions:
+            print "%d regression(s) above %.0f%%" % (
+                len(regressions), 100 * options.threshold)
+            sys.exit(1)
+        print "No regressions above %.0f%%" % (100 * options.threshold)
+
+if __name__ == "__main__":
+    main(sys.argv)
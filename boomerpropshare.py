@@ -6,7 +6,6 @@
 # You'll want to copy this file to AgentNameXXX.py for various versions of XXX,
 # probably get rid of the silly logging messages, and then add more logic.
 
-import random
 import logging
 
 from messages import Upload, Request
@@ -33,28 +32,17 @@ class BoomerPropShare(Peer):
 
         requests = []
         
-        random.shuffle(needed_pieces)
+        self.rng.shuffle(needed_pieces)
 
 
-        # records the total number of each piece
-        total_piece_count = dict()
-
-        # record which pieces are available from each peer
-        for peer in peers:
-            av_set = set(peer.available_pieces)
-            for piece in av_set:
-                # add piece to dictionary if not already present
-                if piece not in total_piece_count.keys():
-                    total_piece_count[piece] = [1, [peer.id]]
-                else:
-                # add to total piece count, and record that this peer has it
-                    total_piece_count[piece][0] += 1
-                    total_piece_count[piece][1].append(peer.id)
+        # the sim keeps count of how many peers have each piece
+        total_piece_count = history.piece_counts
 
         # requests all available pieces from all peers
         for peer in peers:
-            av_set = set(peer.available_pieces)
-            isect = av_set.intersection(np_set)
+            # available_pieces is shared by every agent this round; only
+            # read it.
+            isect = np_set.intersection(peer.available_pieces)
             n = min(self.max_requests, len(isect))
 
             # request all available pieces if possible
@@ -69,15 +57,15 @@ class BoomerPropShare(Peer):
                 # make a list of pieces and rarity from dictionary
                 piece_rarity = []
                 for piece in isect:
-                    piece_rarity.append((total_piece_count[piece][0], piece))
+                    piece_rarity.append((total_piece_count[piece], piece))
 
                 # randomize so peers don't have the same priority for equally rare pieces
-                random.shuffle(piece_rarity)
+                self.rng.shuffle(piece_rarity)
                 # sort from rarest to most common
                 piece_rarity.sort(key = lambda x: x[0])
                 # get n rarest pieces and then shuffle for symmetry breaking
                 pieces = [x[1] for x in piece_rarity[:n]]
-                random.shuffle(pieces)
+                self.rng.shuffle(pieces)
 
                 for piece in pieces:
                     start_block = self.pieces[piece]
@@ -96,17 +84,8 @@ class BoomerPropShare(Peer):
 
 
         if round > 0:
-            # previous rounds histories
-            dl_history1 = history.downloads[round-1]
-            dl_history = dict()
-
-            # add to dict
-            for down in dl_history1:
-                source_id = down.from_id
-                if source_id not in dl_history.keys():
-                    dl_history[source_id] = down.blocks
-                else:
-                    dl_history[source_id] += down.blocks
+            # how many blocks each peer sent us last round
+            dl_history = history.received_from(1)
 
         if len(requests) == 0:
             chosen = []
@@ -150,10 +129,10 @@ class BoomerPropShare(Peer):
             # add randomly selected peers with bandwidth allocation
             if len(rand_candidates) > 0:
                 if len(uploads) == 0:
-                    random_candidate = random.choice(rand_candidates)
+                    random_candidate = self.rng.choice(rand_candidates)
                     uploads.append (Upload(self.id, random_candidate, self.up_bw))
                 else:
-                    random_candidate = random.choice(rand_candidates)
+                    random_candidate = self.rng.choice(rand_candidates)
                     uploads.append (Upload(self.id, random_candidate, self.up_bw * rand_frac))
 
         return uploads
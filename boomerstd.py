@@ -6,7 +6,6 @@
 # You'll want to copy this file to AgentNameXXX.py for various versions of XXX,
 # probably get rid of the silly logging messages, and then add more logic.
 
-import random
 import logging
 from collections import Counter
 import math
@@ -35,28 +34,17 @@ class BoomerStd(Peer):
 
         requests = []
         
-        random.shuffle(needed_pieces)
+        self.rng.shuffle(needed_pieces)
 
 
-        # records the total number of each piece
-        total_piece_count = dict()
-
-        # record which pieces are available from each peer
-        for peer in peers:
-            av_set = set(peer.available_pieces)
-            for piece in av_set:
-                # add piece to dictionary if not already present
-                if piece not in total_piece_count.keys():
-                    total_piece_count[piece] = [1, [peer.id]]
-                else:
-                # add to total piece count, and record that this peer has it
-                    total_piece_count[piece][0] += 1
-                    total_piece_count[piece][1].append(peer.id)
+        # the sim keeps count of how many peers have each piece
+        total_piece_count = history.piece_counts
 
         # requests all available pieces from all peers
         for peer in peers:
-            av_set = set(peer.available_pieces)
-            isect = av_set.intersection(np_set)
+            # available_pieces is shared by every agent this round; only
+            # read it.
+            isect = np_set.intersection(peer.available_pieces)
             n = min(self.max_requests, len(isect))
 
             # request all available pieces if possible
@@ -71,15 +59,15 @@ class BoomerStd(Peer):
                 # make a list of pieces and rarity from dictionary
                 piece_rarity = []
                 for piece in isect:
-                    piece_rarity.append((total_piece_count[piece][0], piece))
+                    piece_rarity.append((total_piece_count[piece], piece))
 
                 # randomize so peers don't have the same priority for equally rare pieces
-                random.shuffle(piece_rarity)
+                self.rng.shuffle(piece_rarity)
                 # sort from rarest to most common
                 piece_rarity.sort(key = lambda x: x[0])
                 # get n rarest pieces and then shuffle for symmetry breaking
                 pieces = [x[1] for x in piece_rarity[:n]]
-                random.shuffle(pieces)
+                self.rng.shuffle(pieces)
 
                 for piece in pieces:
                     start_block = self.pieces[piece]
@@ -94,25 +82,8 @@ class BoomerStd(Peer):
 
 
         if round >= 2:
-            # get download histories of previous rounds
-            dl_history1 = history.downloads[round-1]
-            dl_history2 = history.downloads[round-2]
-            dl_history = dict()
-
-            # fill in dictionary with how many blocks each peer has contributed last 2 turns
-            for down in dl_history1:
-                source_id = down.from_id
-                if source_id not in dl_history.keys():
-                    dl_history[source_id] = down.blocks
-                else:
-                    dl_history[source_id] += down.blocks
-
-            for down in dl_history2:
-                source_id = down.from_id
-                if source_id not in dl_history.keys():
-                    dl_history[source_id] = down.blocks
-                else:
-                    dl_history[source_id] += down.blocks
+            # how many blocks each peer has contributed last 2 turns
+            dl_history = history.received_from(2)
 
         if len(requests) == 0:
             #logging.debug("No one wants my pieces!")
@@ -120,11 +91,12 @@ class BoomerStd(Peer):
             bws = []
 
         else:
+            requests = requests[:]  # the sim's list; don't change it
+            chosen = []
             if round >= 2:
                 # rank received requests by upload contribution
                 all_requesters = []
                 requesters_upload = []
-                chosen = []
 
                 # make list of all peers making requests
                 for request in requests:
@@ -156,18 +128,16 @@ class BoomerStd(Peer):
                 if round%3 != 0:
                     if len(requests) > 0:
                         # optimistically unchoke random request
-                        random_request = random.choice(requests)
+                        random_request = self.rng.choice(requests)
                         chosen.append(random_request.requester_id)
                         requests.remove(random_request)
 
-                # fill remaining spots with random requests
-                while len(chosen) < slots and len(requests) > 0:
-                    random_request = random.choice(requests)
-                    chosen.append(random_request.requester_id)
-                    requests.remove(random_request)
-
-                
-                    
+            # fill remaining spots with random requests (all of them in the
+            # first two rounds, before there's any history to go on)
+            while len(chosen) < slots and len(requests) > 0:
+                random_request = self.rng.choice(requests)
+                chosen.append(random_request.requester_id)
+                requests.remove(random_request)
 
             bws = even_split(self.up_bw, len(chosen))
         # create actual uploads out of the list of peer ids and bandwidths
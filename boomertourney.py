@@ -1,10 +1,9 @@
-import random
 import logging
 from collections import Counter
 import math
 
 from messages import Upload, Request
-from util import even_split
+from util import even_split, bits_below, bits_intersect, popcount
 from peer import Peer
 
 class BoomerTourney(Peer):
@@ -27,28 +26,17 @@ class BoomerTourney(Peer):
 
         requests = []
         
-        random.shuffle(needed_pieces)
+        self.rng.shuffle(needed_pieces)
 
 
-        # records the total number of each piece
-        total_piece_count = dict()
-
-        # record which pieces are available from each peer
-        for peer in peers:
-            av_set = set(peer.available_pieces)
-            for piece in av_set:
-                # add piece to dictionary if not already present
-                if piece not in total_piece_count.keys():
-                    total_piece_count[piece] = [1, [peer.id]]
-                else:
-                # add to total piece count, and record that this peer has it
-                    total_piece_count[piece][0] += 1
-                    total_piece_count[piece][1].append(peer.id)
+        # the sim keeps count of how many peers have each piece
+        total_piece_count = history.piece_counts
 
         # requests all available pieces from all peers
         for peer in peers:
-            av_set = set(peer.available_pieces)
-            isect = av_set.intersection(np_set)
+            # available_pieces is shared by every agent this round; only
+            # read it.
+            isect = np_set.intersection(peer.available_pieces)
             n = min(self.max_requests, len(isect))
 
             # request all available pieces if possible
@@ -63,15 +51,15 @@ class BoomerTourney(Peer):
                 # make a list of pieces and rarity from dictionary
                 piece_rarity = []
                 for piece in isect:
-                    piece_rarity.append((total_piece_count[piece][0], piece))
+                    piece_rarity.append((total_piece_count[piece], piece))
 
                 # randomize so peers don't have the same priority for equally rare pieces
-                random.shuffle(piece_rarity)
+                self.rng.shuffle(piece_rarity)
                 # sort from rarest to most common
                 piece_rarity.sort(key = lambda x: x[0])
                 # get n rarest pieces and then shuffle for symmetry breaking
                 pieces = [x[1] for x in piece_rarity[:n]]
-                random.shuffle(pieces)
+                self.rng.shuffle(pieces)
 
                 for piece in pieces:
                     start_block = self.pieces[piece]
@@ -88,7 +76,7 @@ class BoomerTourney(Peer):
 
         needed = lambda i: self.pieces[i] < self.conf.blocks_per_piece
         needed_pieces = filter(needed, range(len(self.pieces)))
-        np_set = set(needed_pieces)
+        np_bits = bits_below(self.pieces, self.conf.blocks_per_piece)
 
         # After finishing all pieces, feed the peers with the least pieces blocks
         # This way other good algorithms will rank lower :)
@@ -104,12 +92,11 @@ class BoomerTourney(Peer):
 
             return uploads
 
-        random.shuffle(peers)
+        self.rng.shuffle(peers)
 
         for peer in peers:
-            av_set = set(peer.available_pieces)
-            isect = list(av_set.intersection(np_set))
-            requesters_ranked.append([peer.id,len(isect)])
+            overlap = popcount(bits_intersect(peer.bitfield, np_bits))
+            requesters_ranked.append([peer.id, overlap])
 
         # ranks peers in order of most overlap pieces to least
             
@@ -140,25 +127,8 @@ class BoomerTourney(Peer):
         #END PASTE
         
         if round >= 2:
-            # get download histories of previous rounds
-            dl_history1 = history.downloads[round-1]
-            dl_history2 = history.downloads[round-2]
-            dl_history = dict()
-
-            # fill in dictionary with how many blocks each peer has contributed last 2 turns
-            for down in dl_history1:
-                source_id = down.from_id
-                if source_id not in dl_history.keys():
-                    dl_history[source_id] = down.blocks
-                else:
-                    dl_history[source_id] += down.blocks
-
-            for down in dl_history2:
-                source_id = down.from_id
-                if source_id not in dl_history.keys():
-                    dl_history[source_id] = down.blocks
-                else:
-                    dl_history[source_id] += down.blocks
+            # how many blocks each peer has contributed last 2 turns
+            dl_history = history.received_from(2)
 
         if len(requests) == 0:
             #logging.debug("No one wants my pieces!")
@@ -180,7 +150,7 @@ class BoomerTourney(Peer):
                 # random shuffle?
 
                 while len(all_requesters) > 0:
-                    random_request = random.choice(all_requesters)
+                    random_request = self.rng.choice(all_requesters)
                     chosen.append(random_request)
                     all_requesters.remove(random_request)
 
@@ -6,7 +6,6 @@
 # You'll want to copy this file to AgentNameXXX.py for various versions of XXX,
 # probably get rid of the silly logging messages, and then add more logic.
 
-import random
 import logging
 import math
 
@@ -38,28 +37,17 @@ class BoomerTyrant(Peer):
 
         requests = []
         
-        random.shuffle(needed_pieces)
+        self.rng.shuffle(needed_pieces)
 
 
-        # records the total number of each piece
-        total_piece_count = dict()
-
-        # record which pieces are available from each peer
-        for peer in peers:
-            av_set = set(peer.available_pieces)
-            for piece in av_set:
-                # add piece to dictionary if not already present
-                if piece not in total_piece_count.keys():
-                    total_piece_count[piece] = [1, [peer.id]]
-                else:
-                # add to total piece count, and record that this peer has it
-                    total_piece_count[piece][0] += 1
-                    total_piece_count[piece][1].append(peer.id)
+        # the sim keeps count of how many peers have each piece
+        total_piece_count = history.piece_counts
 
         # requests all available pieces from all peers
         for peer in peers:
-            av_set = set(peer.available_pieces)
-            isect = av_set.intersection(np_set)
+            # available_pieces is shared by every agent this round; only
+            # read it.
+            isect = np_set.intersection(peer.available_pieces)
             n = min(self.max_requests, len(isect))
 
             # request all available pieces if possible
@@ -74,22 +62,22 @@ class BoomerTyrant(Peer):
                 # make a list of pieces and rarity from dictionary
                 piece_rarity = []
                 for piece in isect:
-                    piece_rarity.append((total_piece_count[piece][0], piece))
+                    piece_rarity.append((total_piece_count[piece], piece))
 
                 # randomize so peers don't have the same priority for equally rare pieces
-                random.shuffle(piece_rarity)
+                self.rng.shuffle(piece_rarity)
                 # sort from rarest to most common
                 piece_rarity.sort(key = lambda x: x[0])
                 # get n rarest pieces and then shuffle for symmetry breaking
                 pieces = [x[1] for x in piece_rarity[:n]]
-                random.shuffle(pieces)
+                self.rng.shuffle(pieces)
 
                 for piece in pieces:
                     start_block = self.pieces[piece]
                     r = Request(self.id, peer.id, piece, start_block)
                     requests.append(r)
 
-        logging.debug("\nrequests for {}:\n{}\n".format(self.id, requests))
+        logging.debug("\nrequests for %s:\n%s\n", self.id, requests)
 
         return requests
 
@@ -107,8 +95,7 @@ class BoomerTyrant(Peer):
         round = history.current_round()
 
 
-        logging.debug("%s again.  It's round %d." % (
-            self.id, round))
+        logging.debug("%s again.  It's round %d.", self.id, round)
         # One could look at other stuff in the history too here.
         # For example, history.downloads[round-1] (if round != 0, of course)
         # has a list of Download objects for each Download to this peer in
@@ -122,11 +109,7 @@ class BoomerTyrant(Peer):
                     self.peer_ratios[peer.id]['u'] = 1.0
         else:
             # update download rate
-            add_downloads = dict()
-            for download in history.downloads[-1]:
-                if download.from_id not in add_downloads:
-                    add_downloads[download.from_id] = 0
-                add_downloads[download.from_id] += download.blocks
+            add_downloads = history.received_from(1)
             for from_id, blocks in add_downloads.items():
                 self.peer_ratios[from_id]['d'] = blocks
 
@@ -135,24 +118,10 @@ class BoomerTyrant(Peer):
                 if peer_id not in add_downloads:
                     peer_dict['u'] = peer_dict['u'] * (1+self.alpha)
                 # unchoked for last r periods
-                else:
-                    unchoked = True
-                    # check the last r periods
-                    for i in range(min(self.r, round)):
-                        # is peer in last i period
-                        found_peer = False
-                        for download in history.downloads[-1*(i+1)]:
-                            if download.from_id == peer_id:
-                                found_peer = True
-                                break
-                        # didn't find peer in one of last r periods
-                        if not found_peer:
-                            unchoked = False
-                            break
-                    if unchoked:
-                        peer_dict['u'] = peer_dict['u'] * (1-self.gamma)
-
-        logging.debug("\npeer_ratios for {}:\n{}\n".format(self.id, self.peer_ratios))
+                elif history.upload_streak(peer_id) >= min(self.r, round):
+                    peer_dict['u'] = peer_dict['u'] * (1-self.gamma)
+
+        logging.debug("\npeer_ratios for %s:\n%s\n", self.id, self.peer_ratios)
 
         chosen = []
         bws = []
@@ -178,9 +147,9 @@ class BoomerTyrant(Peer):
                 bws.append(min(bw_left, math.floor(bw)))
                 bw_left -= min(bw_left, math.floor(bw))
 
-            logging.debug("\npriorities for {}:\n{}".format(self.id, upload_to))
+            logging.debug("\npriorities for %s:\n%s", self.id, upload_to)
 
-            # request = random.choice(requests)
+            # request = self.rng.choice(requests)
             # chosen = [request.requester_id]
             # Evenly "split" my upload bandwidth among the one chosen requester
             # bws = even_split(self.up_bw, len(chosen))
@@ -189,6 +158,7 @@ class BoomerTyrant(Peer):
         uploads = [Upload(self.id, peer_id, bw)
                    for (peer_id, bw) in zip(chosen, bws)]
 
-        logging.debug("\nuploads for {} with bw {}:\n{}\n{}\n".format(self.id, self.up_bw, chosen, bws))
+        logging.debug("\nuploads for %s with bw %s:\n%s\n%s\n",
+                      self.id, self.up_bw, chosen, bws)
             
         return uploads
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+
+"""
+Time budgets for agent decisions.
+
+Each peer gets a budget per round for its requests() and uploads() calls
+together:
+
+  soft budget: going over is counted, but the decisions stand.
+  hard budget: the call is interrupted (with SIGALRM, where available) and
+               replaced by an empty decision -- no Requests or no Uploads.
+               A peer that has used up its hard budget in requests() gets
+               no uploads() call that round.
+
+DecisionClock times and enforces one round's calls; DecisionTimes keeps
+per-peer latency distributions and overrun counts across rounds and runs.
+"""
+
+import time
+import signal
+import logging
+
+from util import DecisionTimeout
+from stats import RunningStats
+
+
+def budgets_on(conf):
+    return bool(conf.soft_budget or conf.hard_budget)
+
+
+def _raise_timeout(signum, frame):
+    raise DecisionTimeout()
+
+
+def call_with_budget(f, budget):
+    """
+    Call f() and time it.  Returns (result, seconds, overran).  If budget
+    (in seconds) is not None and f takes longer, result is None and overran
+    is True; a budget <= 0 is already used up, so f isn't called.  Where
+    possible f is interrupted when the budget runs out; otherwise it runs
+    to the end and its result is thrown away.
+    """
+    start = time.time()
+    if budget is None:
+        return (f(), time.time() - start, False)
+    if budget <= 0:
+        return (None, 0.0, True)
+
+    try:
+        old_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+        armed = True
+    except (AttributeError, ValueError):
+        # No SIGALRM on this platform, or not the main thread.
+        armed = False
+    timed_out = False
+    try:
+        try:
+            if armed:
+                signal.setitimer(signal.ITIMER_REAL, budget)
+            result = f()
+        except DecisionTimeout:
+            timed_out = True
+    finally:
+        if armed:
+            timed_out = _disarm(old_handler) or timed_out
+    elapsed = time.time() - start
+    if timed_out or elapsed > budget:
+        return (None, elapsed, True)
+    return (result, elapsed, False)
+
+
+def _disarm(old_handler):
+    """
+    Stop the timer and put back the old SIGALRM handler.  Returns True if
+    the timer went off after f() returned but before it was stopped; the
+    handler for a signal that's already arrived runs as soon as
+    setitimer() returns.
+    """
+    fired = False
+    try:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    except DecisionTimeout:
+        fired = True
+    signal.signal(signal.SIGALRM, old_handler)
+    return fired
+
+
+class DecisionClock:
+    """
+    Times one round of agent decisions and enforces the hard budget.
+
+    spent:   dict : peer_id -> seconds spent deciding this round
+    overran: dict : peer_id -> the call ('requests' or 'uploads') that went
+             over the hard budget this round
+    """
+    def __init__(self, hard_budget):
+        self.hard_budget = hard_budget
+        self.start_round()
+
+    def start_round(self):
+        self.spent = dict()
+        self.overran = dict()
+
+    def call(self, peer_id, phase, f):
+        """Call f() for peer_id; an empty decision if it goes over."""
+        if peer_id in self.overran:
+            return []
+        spent = self.spent.get(peer_id, 0.0)
+        budget = None
+        if self.hard_budget:
+            budget = self.hard_budget - spent
+        (result, elapsed, overran) = call_with_budget(f, budget)
+        self.spent[peer_id] = spent + elapsed
+        if overran:
+            self.overran[peer_id] = phase
+            return []
+        return result
+
+
+class DecisionTimes:
+    """
+    Per-peer decision latency (seconds per round, requests() and uploads()
+    together) and budget overruns.  Latencies are kept as a histogram of
+    values rounded to 3 significant digits, so memory doesn't grow with
+    the number of rounds.
+    """
+    def __init__(self, soft_budget, hard_budget):
+        self.soft_budget = soft_budget
+        self.hard_budget = hard_budget
+        self.peer_ids = []
+        self.latency = dict()        # peer_id -> RunningStats
+        self.soft_overruns = dict()  # peer_id -> count
+        self.hard_overruns = dict()  # peer_id -> count
+
+    def _add_peer(self, peer_id):
+        self.peer_ids.append(peer_id)
+        self.latency[peer_id] = RunningStats(keep_counts=True)
+        self.soft_overruns[peer_id] = 0
+        self.hard_overruns[peer_id] = 0
+
+    def add_round(self, round, spent, overran):
+        """spent, overran: a DecisionClock's, for this round"""
+        for peer_id in sorted(spent):
+            if peer_id not in self.latency:
+                self._add_peer(peer_id)
+            t = spent[peer_id]
+            self.latency[peer_id].add(float("%.3g" % t))
+            if self.soft_budget and t > self.soft_budget:
+                self.soft_overruns[peer_id] += 1
+            if peer_id in overran:
+                self.hard_overruns[peer_id] += 1
+                logging.warning(
+                    "%s went over its hard budget of %gs in %s() in round "
+                    "%d; substituted an empty decision" % (
+                        peer_id, self.hard_budget, overran[peer_id], round))
+
+    def merge(self, other):
+        for peer_id in other.peer_ids:
+            if peer_id not in self.latency:
+                self._add_peer(peer_id)
+            self.latency[peer_id].merge(other.latency[peer_id])
+            self.soft_overruns[peer_id] += other.soft_overruns[peer_id]
+            self.hard_overruns[peer_id] += other.hard_overruns[peer_id]
+
+    def lines(self):
+        """Per-peer latency percentiles (in ms) and overruns"""
+        fmt = "%-20s %7s %9s %9s %9s %9s %6s %6s"
+        ans = [fmt % ("peer", "rounds", "p50 ms", "p90 ms", "p99 ms",
+                      "max ms", "soft", "hard")]
+        for peer_id in self.peer_ids:
+            l = self.latency[peer_id]
+            ans.append(fmt % (
+                peer_id, l.n,
+                "%.3f" % (1000 * l.quantile(0.5)),
+                "%.3f" % (1000 * l.quantile(0.9)),
+                "%.3f" % (1000 * l.quantile(0.99)),
+                "%.3f" % (1000 * l.quantile(1.0)),
+                self.soft_overruns[peer_id], self.hard_overruns[peer_id]))
+        return ans
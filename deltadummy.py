@@ -0,0 +1,59 @@
+#!/usr/bin/python
+
+# Dummy's strategy written against the delta interface (see DeltaPeer in
+# peer.py): instead of being handed everyone's available pieces each round,
+# it keeps its own picture of the swarm from what changed.
+
+from messages import Upload, Request
+from util import even_split
+from peer import DeltaPeer
+
+class DeltaDummy(DeltaPeer):
+    def post_init(self):
+        # peer_id -> set of pieces that peer has available
+        self.available = dict()
+
+    def requests_delta(self, changes):
+        """
+        changes: a RoundChanges -- who finished which pieces last round
+        (everything they have, in round 0), and our downloads last round
+
+        returns: a list of Request() objects
+        """
+        for (peer_id, pieces) in changes.new_pieces.items():
+            if peer_id != self.id:
+                self.available.setdefault(peer_id, set()).update(pieces)
+
+        needed = lambda i: self.pieces[i] < self.conf.blocks_per_piece
+        needed_pieces = filter(needed, range(len(self.pieces)))
+        np_set = set(needed_pieces)
+
+        requests = []
+        self.rng.shuffle(needed_pieces)
+        for peer_id in sorted(self.available):
+            isect = self.available[peer_id].intersection(np_set)
+            n = min(self.max_requests, len(isect))
+            # Sorted, so the sample doesn't depend on set iteration order.
+            for piece_id in self.rng.sample(sorted(isect), n):
+                start_block = self.pieces[piece_id]
+                requests.append(Request(self.id, peer_id, piece_id,
+                                        start_block))
+        return requests
+
+    def uploads_delta(self, requests, changes):
+        """
+        requests -- the requests for this peer for this round
+        changes -- the same RoundChanges requests_delta() got
+
+        returns: list of Upload objects.
+        """
+        if len(requests) == 0:
+            chosen = []
+            bws = []
+        else:
+            request = self.rng.choice(requests)
+            chosen = [request.requester_id]
+            bws = even_split(self.up_bw, len(chosen))
+
+        return [Upload(self.id, peer_id, bw)
+                for (peer_id, bw) in zip(chosen, bws)]
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+
+"""
+The simulator core, minus the agents: validating each round's Requests and
+Uploads, routing requests, resolving transfers, and keeping the swarm state
+and History up to date.  Sim.run_sim_once drives it with live agents;
+replay.py drives it with decisions recorded in a trace.
+"""
+
+import math
+import random
+
+from messages import Upload, Request, Download
+from util import IllegalUpload, IllegalRequest, derive_seed
+from history import History
+from swarm import make_swarm_state
+
+
+# Validation messages, in the order the checks are applied.  If several
+# messages are bad, the error reports the first message failing the
+# earliest check, same as checking the whole list one rule at a time.
+UPLOAD_ERRORS = [
+    "List of Uploads contains non-Upload object.",
+    "Can't upload to yourself.",
+    "Upload.from != peer id.",
+    "Upload bandwidth must be non-negative!",
+    ]
+REQUEST_ERRORS = [
+    "List of Requests contains non-Request object.",
+    "Request asks for non-existent piece!",
+    "Request mentions non-existent peer!",
+    "Request has wrong peer id!",
+    # Must request the _next_ necessary block
+    "Request has bad start block!",
+    "Asking for piece peer does not have!",
+    ]
+
+
+def initial_pieces(conf, peer_id):
+    """Seeds start with every piece, everyone else with nothing."""
+    if peer_id.startswith("Seed"):
+        return [conf.blocks_per_piece]*conf.num_pieces
+    else:
+        return [0]*conf.num_pieces
+
+
+class Engine:
+    """
+    One run's worth of simulator state.
+
+    state:   the swarm state (who has what), see swarm.py
+    history: the History of the run
+    new_pieces:
+             dict : peer_id -> [pieces that became available in the last
+             apply_delta(), in increasing order] -- at the start,
+             everything anyone has.  For delta agents (see
+             peer.DeltaPeer); don't modify.
+    """
+    def __init__(self, conf, peer_ids, upload_rates, iteration=0):
+        """
+        upload_rates: dict : peer_id -> up bw
+        iteration: which run this is, for seeding the validation sample
+        """
+        self.conf = conf
+        self.peer_ids = peer_ids[:]
+        self.peer_id_set = set(peer_ids)
+        self.upload_rates = upload_rates
+        self.validate_rng = random.Random(derive_seed(conf.seed, iteration,
+                                                       "validate"))
+
+        # Who has what, plus incremental completion tracking.
+        pieces = dict((pid, initial_pieces(conf, pid)) for pid in peer_ids)
+        self.state = make_swarm_state(conf.state_backend, conf, peer_ids,
+                                      pieces)
+        self.history = History(peer_ids, upload_rates,
+                               self.state.piece_counts, conf.history_window)
+        self.new_pieces = self.state.pop_newly_available()
+
+    def sample(self, lst):
+        """
+        In trusted-agents mode, only validate a random sample of each
+        message list.  Uses its own RNG so agents see the same random
+        stream either way.
+        """
+        if not self.conf.trusted_agents or not lst:
+            return lst
+        n = int(math.ceil(self.conf.validate_fraction * len(lst)))
+        return [lst[i] for i in
+                sorted(self.validate_rng.sample(xrange(len(lst)), n))]
+
+    def check_uploads(self, peer_id, uploads):
+        """Raise an IllegalUpload exception if there is a problem."""
+        best = len(UPLOAD_ERRORS)
+        bad = None
+        for u in self.sample(uploads):
+            if not isinstance(u, Upload):
+                k = 0
+            elif u.to_id == peer_id:
+                k = 1
+            elif u.from_id != peer_id:
+                k = 2
+            elif u.bw < 0:
+                k = 3
+            else:
+                continue
+            if k < best:
+                (best, bad) = (k, u)
+                if k == 0:
+                    break
+        if bad is not None:
+            raise IllegalUpload(UPLOAD_ERRORS[best] +
+                                " Bad element: %s" % bad)
+
+        limit = self.upload_rates[peer_id]
+        if sum(u.bw for u in uploads) > limit:
+            raise IllegalUpload("Can't upload more than limit of %d. %s" % (
+                limit, uploads))
+
+        # If we got here, looks ok.
+
+    def check_requests(self, peer_id, requests):
+        """Raise an IllegalRequest exception if there is a problem."""
+        state = self.state
+        peer_id_set = self.peer_id_set
+        num_pieces = self.conf.num_pieces
+        blocks_per_piece = self.conf.blocks_per_piece
+        best = len(REQUEST_ERRORS)
+        bad = None
+        for r in self.sample(requests):
+            if not isinstance(r, Request):
+                k = 0
+            elif r.piece_id < 0 or r.piece_id >= num_pieces:
+                k = 1
+            elif r.peer_id not in peer_id_set:
+                k = 2
+            elif r.requester_id != peer_id:
+                k = 3
+            elif (r.start < 0 or r.start >= blocks_per_piece or
+                  r.start > state.blocks(peer_id, r.piece_id)):
+                k = 4
+            elif not state.has_piece(r.peer_id, r.piece_id):
+                k = 5
+            else:
+                continue
+            if k < best:
+                (best, bad) = (k, r)
+                if k == 0:
+                    break
+        if bad is not None:
+            raise IllegalRequest(REQUEST_ERRORS[best] +
+                                 " Bad element: %s" % bad)
+
+        # If we got here, looks ok
+
+    def route_requests(self, all_requests):
+        """
+        Build this round's routing index: peer_id -> list of Requests
+        addressed to that peer.  A single pass over all the messages,
+        keeping the order each peer would have seen them in before.
+        """
+        routed = dict((pid, []) for pid in self.peer_ids)
+        for rs in all_requests.values():
+            for r in rs:
+                # check_requests already rejected unknown peer ids
+                routed[r.peer_id].append(r)
+        return routed
+
+    def transfer_rates(self, uploads):
+        """
+        Build the (uploader_id, requester_id) -> bw map for this round,
+        in blocks per time period.  If an uploader lists the same
+        requester more than once, the first Upload counts.
+        """
+        rates = dict()
+        for uploader_id in uploads:
+            for u in uploads[uploader_id]:
+                rates.setdefault((uploader_id, u.to_id), u.bw)
+        return rates
+
+    def resolve_transfers(self, requests, rates):
+        """
+        Figure out how many blocks of each requested piece every requester
+        ends up with.  Requesting the same thing from lots of peers doesn't
+        stack: only the largest amount for each piece counts.
+
+        Returns the delta -- a list of (requester_id, [(piece_id, blocks,
+        from_who)]) -- holding only requesters that actually got something.
+        It's a list so that applying it, here or in an agent-pool worker
+        that got a pickled copy, always goes in the same order.
+        """
+        blocks_per_piece = self.conf.blocks_per_piece
+        delta = []
+        for requester_id in requests:
+            # Group the requests by peer that is being asked, keeping
+            # their order, and drop peers that aren't uploading to us.
+            by_peer = dict()
+            for r in requests[requester_id]:
+                if rates.get((r.peer_id, requester_id), 0) == 0:
+                    continue
+                by_peer.setdefault(r.peer_id, []).append(r)
+            if not by_peer:
+                continue
+
+            # piece -> (blocks, from_who)
+            new_blocks_per_piece = dict()
+            for peer_id in sorted(by_peer):
+                bw = rates[(peer_id, requester_id)]
+                # This bandwidth gets applied in order to each piece requested
+                for r in by_peer[peer_id]:
+                    needed_blocks = blocks_per_piece - r.start
+                    alloced_bw = min(bw, needed_blocks)
+                    old = new_blocks_per_piece.get(r.piece_id)
+                    if old is None or alloced_bw > old[0]:
+                        new_blocks_per_piece[r.piece_id] = (alloced_bw,
+                                                            peer_id)
+                    bw -= alloced_bw
+                    if bw == 0:
+                        break
+            delta.append((requester_id,
+                          [(piece_id,) + new_blocks_per_piece[piece_id]
+                           for piece_id in new_blocks_per_piece]))
+        return delta
+
+    def update_peer_pieces(self, requests, uploads):
+        """
+        Process the uploads and apply the resulting blocks to the swarm
+        state.  Only the cells that changed are touched.
+        Returns dict: peer_id -> [downloads]
+        """
+        delta = self.resolve_transfers(requests, self.transfer_rates(uploads))
+        return self.apply_delta(requests, delta)
+
+    def apply_delta(self, requester_ids, delta):
+        """
+        Apply a delta from resolve_transfers to the swarm state.
+        Returns dict: peer_id -> [downloads], with an entry for each of
+        requester_ids.
+        """
+        downloads = dict((requester_id, []) for requester_id in requester_ids)
+        self.state.apply(delta)
+        self.new_pieces = self.state.pop_newly_available()
+        for (requester_id, transfers) in delta:
+            for (piece_id, blocks, peer_id) in transfers:
+                d = Download(peer_id, requester_id, piece_id, blocks)
+                downloads[requester_id].append(d)
+
+        return downloads
+
+    def record_done(self, round):
+        """Record the peers that finished since the last check, and
+        return them."""
+        done = self.state.pop_newly_done()
+        for peer_id in done:
+            self.history.peer_is_done(round, peer_id)
+        return done
+
+    def all_done(self):
+        return self.state.all_done()
@@ -1,7 +1,15 @@
 #!/usr/bin/python
 
-import copy
 import pprint
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+from messages import Download, Upload
+from util import RoundNotInHistory
+
+# How many recent rounds AgentHistory.received_from keeps precomputed
+RECENT_ROUNDS = 3
 
 
 class AgentHistory:
@@ -14,14 +22,86 @@ class AgentHistory:
     history.uploads: [[Upload objects for round]]  (one sublist for each round)
          All the downloads _from_ this agent.
 
+         Both are read-only views onto the sim's History: indexing a round
+         builds a fresh list of message objects for it.  If the sim runs
+         with a history window of K rounds, only the last K rounds can be
+         looked at; older ones raise RoundNotInHistory.
+
+    history.piece_counts: read-only piece_id -> number of peers that have
+         that piece available right now (see swarm.PieceCounts).  Kept up
+         to date by the sim, so no need to count it yourself.
+
+    The sim also keeps these per-peer aggregates current at the end of
+    every round, so reciprocity strategies needn't rescan the downloads:
+      received_from(k):     dict: peer_id -> blocks it sent us, last k rounds
+      upload_streak(id):    consecutive latest rounds id has sent us blocks
+      uploaded_to(id):      total blocks we've sent id so far
     """
-    def __init__(self, peer_id, downloads, uploads):
+    def __init__(self, peer_id, downloads, uploads, piece_counts=None):
         """
         Pull out just the info for peer_id.
         """
         self.uploads = uploads
         self.downloads = downloads
         self.peer_id = peer_id
+        self.piece_counts = piece_counts
+
+        # [(from_id, blocks)] for each of the last RECENT_ROUNDS rounds
+        self._recent = deque(maxlen=RECENT_ROUNDS)
+        # _received[k-1] : peer_id -> blocks from that peer, last k rounds
+        self._received = [dict() for k in range(RECENT_ROUNDS)]
+        self._streaks = dict()   # peer_id -> consecutive rounds uploading
+        self._uploaded_to = dict()  # peer_id -> blocks we sent them
+
+    def _add_round(self, received):
+        """
+        Called by History.update once per round.
+        received: [(from_id, blocks)] -- this round's downloads to us
+        """
+        self._recent.append(received)
+        # Add up each window newest round first, one download at a time,
+        # so the totals come out exactly as summing the downloads would.
+        for k in range(len(self._received)):
+            totals = dict()
+            for i in range(1, min(k + 1, len(self._recent)) + 1):
+                for (from_id, blocks) in self._recent[-i]:
+                    totals[from_id] = totals.get(from_id, 0) + blocks
+            self._received[k] = totals
+
+        streaks = dict()
+        for (from_id, blocks) in received:
+            streaks[from_id] = self._streaks.get(from_id, 0) + 1
+        self._streaks = streaks
+
+    def _add_upload(self, to_id, blocks):
+        self._uploaded_to[to_id] = self._uploaded_to.get(to_id, 0) + blocks
+
+    def received_from(self, k):
+        """
+        dict: peer_id -> blocks this agent downloaded from that peer over
+        the last k rounds.  Peers that sent nothing aren't in it.  For k up
+        to RECENT_ROUNDS this is precomputed; don't modify it.
+        """
+        if k <= 0:
+            return dict()
+        if k <= len(self._received):
+            return self._received[k-1]
+        totals = dict()
+        for i in range(1, min(k, self.current_round()) + 1):
+            for d in self.downloads[-i]:
+                totals[d.from_id] = totals.get(d.from_id, 0) + d.blocks
+        return totals
+
+    def upload_streak(self, peer_id):
+        """
+        Number of consecutive rounds, up to and including the last one,
+        in which peer_id uploaded blocks to this agent.
+        """
+        return self._streaks.get(peer_id, 0)
+
+    def uploaded_to(self, peer_id):
+        """Total blocks this agent has uploaded to peer_id so far."""
+        return self._uploaded_to.get(peer_id, 0)
 
     def last_round(self):
         return len(self.downloads)-1
@@ -36,24 +116,175 @@ class AgentHistory:
             pprint.pformat(self.uploads))
 
 
+class RoundLog(object):
+    """
+    One round of transfers, stored column-wise with integer peer indices
+    (see History.ids) instead of as message objects.
+
+    Downloads are in order of receiving peer, uploads in order of sending
+    peer, so one peer's slice of a round is found by bisecting dl_to or
+    up_from.  Block counts and bandwidths are nearly always ints; the rare
+    other value (e.g. a fractional bandwidth) is kept as-is in `odd`,
+    keyed by ('dl', i) or ('up', i), so the history gives back exactly
+    what was recorded.
+    """
+    __slots__ = ('dl_to', 'dl_from', 'dl_piece', 'dl_blocks',
+                 'up_from', 'up_to', 'up_bw', 'odd')
+
+    def __init__(self):
+        self.dl_to = array('i')
+        self.dl_from = array('i')
+        self.dl_piece = array('i')
+        self.dl_blocks = array('l')
+        self.up_from = array('i')
+        self.up_to = array('i')
+        self.up_bw = array('l')
+        self.odd = None
+
+    def _store(self, column, kind, value):
+        if type(value) is int:
+            column.append(value)
+        else:
+            column.append(0)
+            if self.odd is None:
+                self.odd = dict()
+            self.odd[(kind, len(column) - 1)] = value
+
+    def add_download(self, to_index, from_index, piece, blocks):
+        self.dl_to.append(to_index)
+        self.dl_from.append(from_index)
+        self.dl_piece.append(piece)
+        self._store(self.dl_blocks, 'dl', blocks)
+
+    def add_upload(self, from_index, to_index, bw):
+        self.up_from.append(from_index)
+        self.up_to.append(to_index)
+        self._store(self.up_bw, 'up', bw)
+
+    def _value(self, column, kind, i):
+        if self.odd is not None and (kind, i) in self.odd:
+            return self.odd[(kind, i)]
+        return column[i]
+
+    def downloads(self, ids, to_index):
+        """Download objects to peer to_index"""
+        lo = bisect_left(self.dl_to, to_index)
+        hi = bisect_right(self.dl_to, to_index, lo)
+        to_id = ids[to_index]
+        return [Download(ids[self.dl_from[i]], to_id, self.dl_piece[i],
+                         self._value(self.dl_blocks, 'dl', i))
+                for i in xrange(lo, hi)]
+
+    def uploads(self, ids, from_index):
+        """Upload objects from peer from_index"""
+        lo = bisect_left(self.up_from, from_index)
+        hi = bisect_right(self.up_from, from_index, lo)
+        from_id = ids[from_index]
+        return [Upload(from_id, ids[self.up_to[i]],
+                       self._value(self.up_bw, 'up', i))
+                for i in xrange(lo, hi)]
+
+
+class RoundsView(object):
+    """
+    One peer's downloads (or uploads), round by round: view[r] is a list of
+    message objects built on access.  Behaves like the list of lists it
+    replaces for indexing (including negative indices and slices), len()
+    and iteration.
+    """
+    __slots__ = ('history', 'index', 'kind')
+
+    def __init__(self, history, index, kind):
+        self.history = history
+        self.index = index
+        self.kind = kind
+
+    def __len__(self):
+        return self.history.num_rounds
+
+    def _round(self, r):
+        log = self.history.round_log(r)
+        if self.kind == 'downloads':
+            return log.downloads(self.history.ids, self.index)
+        return log.uploads(self.history.ids, self.index)
+
+    def __getitem__(self, r):
+        if isinstance(r, slice):
+            return [self._round(i) for i in xrange(*r.indices(len(self)))]
+        n = len(self)
+        if r < 0:
+            r += n
+        if r < 0 or r >= n:
+            raise IndexError("round %s not in history" % r)
+        return self._round(r)
+
+    def __iter__(self):
+        for r in xrange(len(self)):
+            yield self._round(r)
+
+    def __repr__(self):
+        first = self.history.first_round()
+        return repr([self._round(r) for r in xrange(first, len(self))])
+
+
 class History:
     """History of the whole sim"""
-    def __init__(self, peer_ids, upload_rates):
+    def __init__(self, peer_ids, upload_rates, piece_counts=None, window=None):
         """
+        window:    if set, only keep the last `window` rounds of transfers.
+                   Completion rounds and the totals below are kept as
+                   running aggregates, so Stats don't depend on the window.
+        uploaded / downloaded:
+                   dict : peer_id -> total blocks sent / received so far
+        throughput:
+                   [total blocks transferred in the swarm -- one per round]
+        done_counts:
+                   [number of peers done -- one per round, as of its end]
+        rounds:    [RoundLog -- one per round kept]
+        ids:       [peer_id] -- the peer id for each index used in rounds
         uploads:
-                   dict : peer_id -> [[uploads] -- one list per round]
+                   dict : peer_id -> RoundsView of uploads, one list per round
         downloads:
-                   dict : peer_id -> [[downloads] -- one list per round]
+                   dict : peer_id -> RoundsView of downloads, one list per round
                    
         Keep track of the uploads _from_ and downloads _to_ the
         specified peer id.
         """
         self.upload_rates = upload_rates  # peer_id -> up_bw
+        self.piece_counts = piece_counts  # read-only piece -> holder count
         self.peer_ids = peer_ids[:]
 
         self.round_done = dict()   # peer_id -> round finished
-        self.downloads = dict((pid, []) for pid in peer_ids)
-        self.uploads = dict((pid, []) for pid in peer_ids)
+        self.uploaded = dict((pid, 0) for pid in peer_ids)  # blocks sent
+        self.downloaded = dict((pid, 0) for pid in peer_ids)
+        self.throughput = []
+        self.done_counts = []
+        self.window = window
+        if window:
+            self.rounds = deque(maxlen=window)
+        else:
+            self.rounds = []
+        self.num_rounds = 0
+        # Peers come first, in order.  Uploads to ids that aren't peers get
+        # indices after them.
+        self.ids = peer_ids[:]
+        self.index = dict((pid, i) for (i, pid) in enumerate(peer_ids))
+        self.downloads = dict((pid, RoundsView(self, self.index[pid], 'downloads'))
+                              for pid in peer_ids)
+        self.uploads = dict((pid, RoundsView(self, self.index[pid], 'uploads'))
+                            for pid in peer_ids)
+        # peer_id -> AgentHistory.  The views are live, so one per peer
+        # does for the whole run; update() keeps their aggregates current.
+        self.agent_histories = dict(
+            (pid, AgentHistory(pid, self.downloads[pid], self.uploads[pid],
+                               piece_counts))
+            for pid in peer_ids)
+
+    def _index_of(self, id):
+        if id not in self.index:
+            self.index[id] = len(self.ids)
+            self.ids.append(id)
+        return self.index[id]
 
     def update(self, dls, ups):
         """
@@ -62,37 +293,79 @@ class History:
 
         append these downloads to to the history
         """
-        for pid in self.peer_ids:
-            self.downloads[pid].append(dls[pid])
-            self.uploads[pid].append(ups[pid])
+        log = RoundLog()
+        index = self._index_of
+        uploaded = self.uploaded
+        agents = self.agent_histories
+        round_total = 0
+        for (i, pid) in enumerate(self.peer_ids):
+            received = []
+            got = 0
+            for d in dls[pid]:
+                log.add_download(i, index(d.from_id), d.piece, d.blocks)
+                uploaded[d.from_id] += d.blocks
+                got += d.blocks
+                received.append((d.from_id, d.blocks))
+                agents[d.from_id]._add_upload(pid, d.blocks)
+            agents[pid]._add_round(received)
+            self.downloaded[pid] += got
+            round_total += got
+        self.throughput.append(round_total)
+        # Filled in as peer_is_done hears about this round
+        self.done_counts.append(len(self.round_done))
+        for (i, pid) in enumerate(self.peer_ids):
+            for u in ups[pid]:
+                log.add_upload(i, index(u.to_id), u.bw)
+        self.rounds.append(log)
+        self.num_rounds += 1
+
+    def first_round(self):
+        """index of the oldest round still kept"""
+        return self.num_rounds - len(self.rounds)
+
+    def round_log(self, r):
+        """The RoundLog for round r (0 is the first)"""
+        first = self.first_round()
+        if r < first:
+            raise RoundNotInHistory(
+                "Round %d is outside the history window: only the last %d "
+                "rounds (%d-%d) are kept" % (r, self.window, first,
+                                            self.num_rounds - 1))
+        return self.rounds[r - first]
 
     def peer_is_done(self, round, peer_id):
         # Only save the _first_ round where we hear this
         if peer_id not in self.round_done:
             self.round_done[peer_id] = round
+            if self.done_counts:
+                self.done_counts[-1] = len(self.round_done)
 
     def peer_history(self, peer_id):
-        return AgentHistory(peer_id, self.downloads[peer_id], self.uploads[peer_id])
+        return self.agent_histories[peer_id]
 
     def last_round(self):
         """index of the last completed round"""
-        p = self.peer_ids[0]
-        return len(self.downloads[p])-1
+        return self.num_rounds-1
+
+    def _pretty_lines_for_round(self, r):
+        yield "\nRound %s:\n" % r
+        log = self.round_log(r)
+        for i in xrange(len(log.dl_to)):
+            yield "%s downloaded %d blocks of piece %d from %s\n" % (
+                self.ids[log.dl_to[i]], log._value(log.dl_blocks, 'dl', i),
+                log.dl_piece[i], self.ids[log.dl_from[i]])
 
     def pretty_for_round(self, r):
-        s = "\nRound %s:\n" % r
-        for peer_id in self.peer_ids:
-            ds = self.downloads[peer_id][r]
-            stringify = lambda d: "%s downloaded %d blocks of piece %d from %s\n" % (
-                peer_id, d.blocks, d.piece, d.from_id)
-            s += "".join(map(stringify, ds))
-        return s
+        return "".join(self._pretty_lines_for_round(r))
 
     def pretty(self):
-        s = "History\n"
-        for r in range(self.last_round()+1):
-            s += self.pretty_for_round(r)
-        return s
+        # Join once at the end -- repeated concatenation is quadratic
+        lines = ["History\n"]
+        if self.first_round() > 0:
+            lines.append("(only the last %d rounds are kept)\n" % self.window)
+        for r in range(self.first_round(), self.last_round()+1):
+            lines.extend(self._pretty_lines_for_round(r))
+        return "".join(lines)
 
     def __repr__(self):
         return """History(
@@ -101,4 +374,3 @@ downloads=%s
 )""" % (
     pprint.pformat(self.uploads),
     pprint.pformat(self.downloads))
-
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+"""
+Memory benchmark for the message types in messages.py.
+
+Prints the bytes each message object takes, before (plain classes with a
+per-instance __dict__, as messages.py used to define them) and after
+(__slots__).  Only the object itself and its __dict__ are counted; the ids,
+ints and sets the attributes point to are shared with the rest of the sim.
+
+Usage: membench.py [-n COUNT]
+"""
+
+import sys
+import gc
+from optparse import OptionParser
+
+import messages
+from util import bitfield
+
+
+# The message types as they were before __slots__, for comparison.
+class OldUpload:
+    def __init__(self, from_id, to_id, up_bw):
+        self.from_id = from_id
+        self.to_id = to_id
+        self.bw = up_bw
+
+class OldRequest:
+    def __init__(self, requester_id, peer_id, piece_id, start):
+        self.requester_id = requester_id
+        self.peer_id = peer_id
+        self.piece_id = piece_id
+        self.start = start
+
+class OldDownload:
+    def __init__(self, from_id, to_id, piece, blocks):
+        self.from_id = from_id
+        self.to_id = to_id
+        self.piece = piece
+        self.blocks = blocks
+
+class OldPeerInfo:
+    def __init__(self, id, available):
+        self.id = id
+        self.available_pieces = available
+
+
+def object_size(o):
+    size = sys.getsizeof(o)
+    d = getattr(o, '__dict__', None)
+    if d is not None:
+        size += sys.getsizeof(d)
+    return size
+
+
+def bytes_per_message(make, n):
+    """Average object_size over n freshly made messages."""
+    gc.collect()
+    objs = [make(i) for i in xrange(n)]
+    return sum(object_size(o) for o in objs) / float(n)
+
+
+def main(args):
+    parser = OptionParser(usage="Usage: %prog [-n COUNT]")
+    parser.add_option("-n", dest="count", default=10000, type="int",
+                      help="Number of messages of each type to allocate")
+    (options, args) = parser.parse_args(args[1:])
+    n = options.count
+
+    available = set(range(10))
+    bits = bitfield(available)
+    cases = [
+        ("Upload", lambda i: OldUpload("Peer1", "Peer2", i),
+         lambda i: messages.Upload("Peer1", "Peer2", i)),
+        ("Request", lambda i: OldRequest("Peer1", "Peer2", i, 0),
+         lambda i: messages.Request("Peer1", "Peer2", i, 0)),
+        ("Download", lambda i: OldDownload("Peer1", "Peer2", i, 2),
+         lambda i: messages.Download("Peer1", "Peer2", i, 2)),
+        ("PeerInfo", lambda i: OldPeerInfo("Peer1", available),
+         lambda i: messages.PeerInfo("Peer1", bits)),
+        ]
+
+    print "%-10s %10s %10s %8s" % ("message", "before", "after", "saved")
+    for (name, old, new) in cases:
+        before = bytes_per_message(old, n)
+        after = bytes_per_message(new, n)
+        print "%-10s %10.1f %10.1f %7.0f%%" % (
+            name, before, after, 100 * (before - after) / before)
+
+if __name__ == "__main__":
+    main(sys.argv)
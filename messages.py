@@ -1,6 +1,27 @@
 #!/usr/bin/python
 
-class Upload:
+# The sim allocates lots of these every round, and the history keeps every
+# Download and Upload, so they use __slots__ instead of a per-instance
+# __dict__.  Attribute names and reprs are unchanged.
+
+from util import bits_to_list
+
+class Message(object):
+    __slots__ = ()
+
+    # Pickle support for slotted classes (needed by the older pickle
+    # protocols; multiprocessing ships these between processes).
+    def __getstate__(self):
+        return tuple(getattr(self, a) for a in self.__slots__)
+
+    def __setstate__(self, state):
+        for (a, v) in zip(self.__slots__, state):
+            setattr(self, a, v)
+
+
+class Upload(Message):
+    __slots__ = ('from_id', 'to_id', 'bw')
+
     def __init__(self, from_id, to_id, up_bw):
         self.from_id = from_id
         self.to_id = to_id
@@ -10,7 +31,9 @@ class Upload:
         return "Upload(from_id = %s, to_id=%s, bw=%d)" % (
             self.from_id, self.to_id, self.bw)
 
-class Request:
+class Request(Message):
+    __slots__ = ('requester_id', 'peer_id', 'piece_id', 'start')
+
     def __init__(self, requester_id, peer_id, piece_id, start):
         self.requester_id = requester_id
         self.peer_id = peer_id   # peer data is requested from
@@ -21,10 +44,12 @@ class Request:
         return "Request(requester_id=%s, peer_id=%s, piece_id=%d, start=%d)" % (
             self.requester_id, self.peer_id, self.piece_id, self.start)
 
-class Download:
+class Download(Message):
     """ Not actually a message--just used for accounting and history tracking of
      what is actually downloaded.
     """
+    __slots__ = ('from_id', 'to_id', 'piece', 'blocks')
+
     def __init__(self, from_id, to_id, piece, blocks):
         self.from_id = from_id  # who did the agent download from?
         self.to_id = to_id      # Who downloaded?
@@ -37,16 +62,58 @@ class Download:
 
 
 
-            
-class PeerInfo:
+
+class PeerInfo(Message):
     """
     Only passing peer ids and the pieces they have available to each agent.
     This prevents them from accidentally messing up the state of other agents.
+
+    bitfield:         the available pieces as a bitfield (see util.py for
+                      bits_intersect(), popcount() and friends)
+    available_pieces: the same pieces as a set, built the first time it's
+                      asked for.  Every agent in the round gets the same
+                      PeerInfo objects, so it's only built once; don't
+                      modify it.
     """
-    def __init__(self, id, available):
+    __slots__ = ('id', 'bitfield', '_available')
+
+    def __init__(self, id, bitfield):
         self.id = id
-        self.available_pieces = available
+        self.bitfield = bitfield
+        self._available = None
+
+    @property
+    def available_pieces(self):
+        if self._available is None:
+            self._available = set(bits_to_list(self.bitfield))
+        return self._available
 
     def __repr__(self):
         return "PeerInfo(id=%s)" % self.id
 
+
+
+class RoundChanges(Message):
+    """
+    What a delta agent (see peer.DeltaPeer) hears at the start of a round:
+    just what changed since the last one.
+
+    round:      the round about to be played (0 is the first)
+    new_pieces: dict : peer_id -> [pieces that peer finished last round],
+                in increasing order.  In round 0, every piece anyone starts
+                with.  Shared by all agents, so don't modify it.
+    downloads:  [Download objects to this agent last round]
+    history:    the agent's AgentHistory, for the aggregates it keeps
+                (received_from() and friends)
+    """
+    __slots__ = ('round', 'new_pieces', 'downloads', 'history')
+
+    def __init__(self, round, new_pieces, downloads, history):
+        self.round = round
+        self.new_pieces = new_pieces
+        self.downloads = downloads
+        self.history = history
+
+    def __repr__(self):
+        return "RoundChanges(round=%d, new_pieces=%s, downloads=%s)" % (
+            self.round, self.new_pieces, self.downloads)
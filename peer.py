@@ -5,12 +5,27 @@ from messages import Upload, Request
 from util import even_split
 
 class Peer:
-    def __init__(self, config, id, init_pieces, up_bandwidth):
+    """
+    Base class for agents.  Each round the sim calls update_pieces(), then
+    requests(peers, history), then uploads(requests, peers, history), with
+    the whole swarm's PeerInfo and this peer's AgentHistory each time.
+    """
+    # Which interface the sim calls: 1 is requests()/uploads(), 2 is
+    # requests_delta()/uploads_delta() (see DeltaPeer).
+    api_version = 1
+
+    def __init__(self, config, id, init_pieces, up_bandwidth, rng=None):
         self.conf = config
         self.id = id
         self.pieces = init_pieces[:]
         # bandwidth measured in blocks-per-time-period
         self.up_bw = up_bandwidth
+        # This peer's own random stream.  Use it (self.rng.shuffle(...),
+        # self.rng.choice(...)) instead of the random module, so runs are
+        # reproducible from --seed.
+        if rng is None:
+            rng = random.Random()
+        self.rng = rng
 
         # This is an upper bound on the number of requests to send to
         # each peer -- they can't possibly handle more than this in one round
@@ -40,3 +55,35 @@ class Peer:
     def post_init(self):
         # Here to be overridden by child classes
         pass
+
+
+class DeltaPeer(Peer):
+    """
+    Base class for agents written against the delta interface.  Instead of
+    the whole swarm's PeerInfo every round, they get a RoundChanges (see
+    messages.py) with what changed since the last round: pieces each peer
+    newly finished, and the downloads to this peer.  Keeping track of who
+    has what is up to the agent, e.g.
+
+        def requests_delta(self, changes):
+            for (peer_id, pieces) in changes.new_pieces.items():
+                if peer_id != self.id:
+                    self.available.setdefault(peer_id, set()).update(pieces)
+
+    so a round costs in proportion to what happened in it, not to the size
+    of the swarm.  self.pieces is kept current as for any Peer.
+    """
+    api_version = 2
+
+    def requests_delta(self, changes):
+        """Returns a list of Request() objects"""
+        return []
+
+    def uploads_delta(self, requests, changes):
+        """
+        requests: the Requests to this peer this round
+        changes:  the same RoundChanges requests_delta() got
+
+        Returns a list of Upload() objects
+        """
+        return []
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+
+"""
+Wall and CPU time spent in each phase of a run, for --profile-phases.
+
+The sim calls now() to start timing and add(phase, start) when a phase
+ends.  add() returns the current time, so consecutive phases chain:
+
+    t = times.now()
+    ...                              # agent requests()
+    t = times.add("requests", t, "Dummy")
+    ...                              # validation
+    t = times.add("check_requests", t)
+
+With profiling off the sim uses NullPhaseTimes, whose methods do nothing.
+"""
+
+import time
+
+# Report order.  Anything else comes after these, alphabetically.
+PHASES = ["setup", "requests", "check_requests", "route_requests",
+          "uploads", "check_uploads", "update_peer_pieces", "history_update",
+          "logging", "record_done", "trace"]
+
+
+class PhaseTimes:
+    """
+    Totals per (phase, agent class) key -- the agent class is None for
+    phases that aren't about one agent.  Accumulates across rounds and
+    runs; merge() folds in times from another process.
+    """
+    def __init__(self):
+        self.wall = dict()
+        self.cpu = dict()
+        self.calls = dict()
+        self.total_wall = 0.0
+        self.total_cpu = 0.0
+
+    def now(self):
+        return (time.time(), time.clock())
+
+    def add(self, phase, start, agent_class=None):
+        end = self.now()
+        key = (phase, agent_class)
+        self.wall[key] = self.wall.get(key, 0.0) + end[0] - start[0]
+        self.cpu[key] = self.cpu.get(key, 0.0) + end[1] - start[1]
+        self.calls[key] = self.calls.get(key, 0) + 1
+        return end
+
+    def add_run(self, start):
+        """A whole run, started at start, is over."""
+        end = self.now()
+        self.total_wall += end[0] - start[0]
+        self.total_cpu += end[1] - start[1]
+
+    def merge(self, other):
+        for key in other.calls:
+            self.wall[key] = self.wall.get(key, 0.0) + other.wall[key]
+            self.cpu[key] = self.cpu.get(key, 0.0) + other.cpu[key]
+            self.calls[key] = self.calls.get(key, 0) + other.calls[key]
+        self.total_wall += other.total_wall
+        self.total_cpu += other.total_cpu
+
+    def _order(self, key):
+        (phase, agent_class) = key
+        if phase in PHASES:
+            return (PHASES.index(phase), phase, agent_class)
+        return (len(PHASES), phase, agent_class)
+
+    def lines(self):
+        """The breakdown table, as a list of strings"""
+        fmt = "%-20s %-20s %9s %10s %10s %7s"
+        ans = [fmt % ("phase", "agent class", "calls", "wall (s)", "cpu (s)",
+                      "% wall")]
+        total = self.total_wall or 1.0
+
+        def row(phase, agent_class, calls, wall, cpu):
+            return fmt % (phase, agent_class or "", calls, "%.4f" % wall,
+                          "%.4f" % cpu, "%.1f" % (100 * wall / total))
+
+        for key in sorted(self.calls, key=self._order):
+            ans.append(row(key[0], key[1], self.calls[key], self.wall[key],
+                           self.cpu[key]))
+        ans.append(row("other", None, "",
+                       self.total_wall - sum(self.wall.values()),
+                       self.total_cpu - sum(self.cpu.values())))
+        ans.append(row("total", None, "", self.total_wall, self.total_cpu))
+        return ans
+
+
+class NullPhaseTimes:
+    """Stands in for PhaseTimes when profiling is off."""
+    def now(self):
+        return None
+
+    def add(self, phase, start, agent_class=None):
+        return None
+
+    def add_run(self, start):
+        pass
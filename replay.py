@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""
+Replays a trace written with sim.py --trace through the simulator core,
+without any agents: each round's recorded Requests and Uploads are
+validated, turned into downloads and added to a History, exactly as the
+sim does with live agents.  The resulting downloads and finished peers
+must match the ones in the trace, or ReplayMismatch is raised.
+
+This gives a repeatable, agent-independent workload for timing changes to
+the core (engine.py, swarm.py, history.py), and checks that they don't
+change what the simulator computes.
+
+Usage: replay.py [options] TRACEFILE
+"""
+
+import sys
+import time
+from optparse import OptionParser
+
+from util import Params, ReplayMismatch
+from engine import Engine
+from swarm import BACKENDS
+from simtrace import TraceReader
+
+
+def load_rounds(reader):
+    """
+    Decode the whole trace up front, so the timed replay only measures the
+    core.  Returns a list of (round, requests, uploads, downloads, done),
+    where requests and uploads are dicts: peer_id -> [messages].
+    """
+    rounds = []
+    for r in reader.rounds():
+        requests = dict((pid, []) for pid in reader.peer_ids)
+        for req in r.requests():
+            requests[req.requester_id].append(req)
+        uploads = dict((pid, []) for pid in reader.peer_ids)
+        for u in r.uploads():
+            uploads[u.from_id].append(u)
+        rounds.append((r.round, requests, uploads, r.downloads(), r.done))
+    return rounds
+
+
+def make_config(reader, state_backend=None):
+    conf = Params()
+    for (k, v) in reader.config.items():
+        conf.add(str(k), v)
+    if state_backend is not None:
+        conf.add("state_backend", state_backend)
+    return conf
+
+
+def flatten(peer_ids, msgs):
+    return [m for pid in peer_ids for m in msgs[pid]]
+
+
+def replay(conf, peer_ids, upload_rates, rounds):
+    """
+    Run the recorded rounds through a fresh Engine, checking each round's
+    downloads and finished peers against the recording.  Returns the
+    engine's History.
+    """
+    engine = Engine(conf, peer_ids, upload_rates)
+    history = engine.history
+    for (round, requests, uploads, recorded_dls, recorded_done) in rounds:
+        for pid in peer_ids:
+            engine.check_requests(pid, requests[pid])
+        for pid in peer_ids:
+            engine.check_uploads(pid, uploads[pid])
+
+        downloads = engine.update_peer_pieces(requests, uploads)
+        history.update(downloads, uploads)
+        done = engine.record_done(round)
+
+        got = [(d.from_id, d.to_id, d.piece, d.blocks)
+               for d in flatten(peer_ids, downloads)]
+        expected = [(d.from_id, d.to_id, d.piece, d.blocks)
+                    for d in recorded_dls]
+        if got != expected:
+            raise ReplayMismatch("Round %d: downloads %s, trace has %s" %
+                                 (round, got, expected))
+        if done != recorded_done:
+            raise ReplayMismatch("Round %d: peers done %s, trace has %s" %
+                                 (round, done, recorded_done))
+    return history
+
+
+def main(args):
+    parser = OptionParser(usage="Usage: %prog [options] TRACEFILE")
+    parser.add_option("--repeat",
+                      dest="repeat", default=1, type="int",
+                      help="Replay the trace this many times, for timing")
+    parser.add_option("--state-backend",
+                      dest="state_backend", default=None,
+                      help="Replay with this state backend instead of the "
+                      "one in the trace: 'lists' or 'numpy'")
+    (options, args) = parser.parse_args(args[1:])
+    if len(args) != 1:
+        parser.print_help()
+        sys.exit(1)
+    if options.repeat < 1:
+        parser.error("--repeat must be >= 1")
+    if (options.state_backend is not None and
+        options.state_backend not in BACKENDS):
+        parser.error("Unknown state backend: %s" % options.state_backend)
+
+    reader = TraceReader(args[0])
+    conf = make_config(reader, options.state_backend)
+    rounds = load_rounds(reader)
+    peer_ids = reader.peer_ids
+    upload_rates = reader.upload_rates
+    reader.close()
+
+    n_requests = sum(len(rs) for r in rounds for rs in r[1].values())
+    print "Trace: %d peers, %d rounds, %d requests" % (
+        len(peer_ids), len(rounds), n_requests)
+
+    times = []
+    for i in xrange(options.repeat):
+        (wall, cpu) = (time.time(), time.clock())
+        replay(conf, peer_ids, upload_rates, rounds)
+        times.append((time.time() - wall, time.clock() - cpu))
+
+    print "Downloads match the trace."
+    best_wall = min(w for (w, c) in times)
+    best_cpu = min(c for (w, c) in times)
+    print "Best of %d: %.4fs wall, %.4fs cpu, %.1f us/round" % (
+        options.repeat, best_wall, best_cpu,
+        1e6 * best_wall / max(len(rounds), 1))
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,6 +1,5 @@
 #!/usr/bin/python
 
-import random
 from messages import Upload, Request
 from util import even_split
 from peer import Peer
@@ -19,5 +18,5 @@ class Seed(Peer):
             return []
         bws = even_split(self.up_bw, n)
         uploads = [Upload(self.id, p_id, bw)
-                   for (p_id, bw) in zip(random.sample(requester_ids, n), bws)]
+                   for (p_id, bw) in zip(self.rng.sample(requester_ids, n), bws)]
         return uploads
@@ -8,25 +8,39 @@ Simulates one file being shared amongst a set of peers.  The file is divided int
 The simulation proceeds in rounds.  In each round, peers can request pieces from other peers, and then decide how much to upload to others.  Once every peer has every piece, the simulation ends.
 """
 
-import re
 import random
 import sys
 import logging
-import copy
 import itertools
 import pprint
+import multiprocessing
 from optparse import OptionParser
 
-from messages import Upload, Request, Download, PeerInfo
+from messages import PeerInfo
 from util import *
-from stats import Stats
-from history import History
+from stats import Stats, SummaryStats
+from swarm import BACKENDS
+from engine import Engine, initial_pieces
+from agentpool import AgentPool, get_requests, get_uploads
+from simtrace import TraceWriter
+from phases import PhaseTimes, NullPhaseTimes
+from budget import DecisionClock, DecisionTimes, budgets_on
     
 
 class Sim:
     def __init__(self, config):
         self.config = config
         self.up_bws_state = dict()
+        # Accumulates across runs; see phases.py
+        if config.profile_phases:
+            self.phases = PhaseTimes()
+        else:
+            self.phases = NullPhaseTimes()
+        # Per-peer decision latencies, also across runs; see budget.py
+        self.decision_times = None
+        if budgets_on(config):
+            self.decision_times = DecisionTimes(config.soft_budget,
+                                                config.hard_budget)
 
     
     def up_bw(self, peer_id, reinit=False):
@@ -37,116 +51,41 @@ class Sim:
         # Re-initialize up-bws if we are starting a new simulation
         if reinit and peer_id in s:
             del s[peer_id]
+        elif peer_id in s:
+            return s[peer_id]
         
         """Sets the upload bandwidth of seeds to max, other agents at random"""
-        if re.match("Seed",peer_id): the_up_bw = c.max_up_bw
-        else: the_up_bw = random.randint(c.min_up_bw, c.max_up_bw)
+        if peer_id.startswith("Seed"): the_up_bw = c.max_up_bw
+        else: the_up_bw = self.rng.randint(c.min_up_bw, c.max_up_bw)
         
         return s.setdefault(peer_id, the_up_bw)
 
-    def run_sim_once(self):
-        """Return a history"""
+    def run_sim_once(self, trace_path=None, iteration=0):
+        """
+        Return a history.  If trace_path is given, also write a binary trace
+        of the run there (see simtrace.py).
+
+        The sim and every peer get their own random stream, derived from
+        config.seed, the iteration number and the peer id, so a run only
+        depends on those -- not on the order peers are evaluated in or on
+        which process runs it.
+        """
         conf = self.config
+        times = self.phases
+        start = times.now()
+        self.rng = random.Random(derive_seed(conf.seed, iteration, "sim"))
         # Keep track of the current round.  Needs to be in scope for helpers.
         round = 0  
 
-        def check_pred(pred, msg, Exc, lst):
-            """Check if any element of lst matches the predicate.  If it does,
-            raise an exception of type Exc, including the msg and the offending
-            element."""
-            m = map(pred, lst)
-            if True in m:
-                i = m.index(True)
-                raise Exc(msg + " Bad element: %s" % lst[i])
-
-        def check_uploads(peer, uploads):
-            """Raise an IllegalUpload exception if there is a problem."""
-            def check(pred, msg):
-                check_pred(pred, msg, IllegalUpload, uploads)
-
-            not_upload = lambda o: not isinstance(o, Upload)
-            check(not_upload, "List of Uploads contains non-Upload object.")
-
-            self_upload = lambda upload: upload.to_id == peer.id
-            check(self_upload, "Can't upload to yourself.")
-            
-            not_from_self = lambda upload: upload.from_id != peer.id
-            check(not_from_self, "Upload.from != peer id.")
-
-            check(lambda u: u.bw < 0, "Upload bandwidth must be non-negative!")
-
-            limit = self.up_bw(peer.id)
-            if sum(map(lambda u: u.bw, uploads)) > limit:
-                raise IllegalUpload("Can't upload more than limit of %d. %s" % (
-                    limit, uploads))
-
-            # If we got here, looks ok.
-
-        def check_requests(peer, requests, peer_pieces, available):
-            """Raise an IllegalRequest exception if there is a problem."""
-
-            def check(pred, msg):
-                check_pred(pred, msg, IllegalRequest, requests)
-
-            check(lambda o: not isinstance(o, Request),
-                  "List of Requests contains non-Request object.")
-
-            bad_piece_id = lambda r: (r.piece_id < 0 or
-                                      r.piece_id >= self.config.num_pieces)
-            check(bad_piece_id, "Request asks for non-existent piece!")
-            
-            bad_peer_id = lambda r: r.peer_id not in self.peer_ids
-            check(bad_peer_id, "Request mentions non-existent peer!")
-
-            bad_requester_id = lambda r: r.requester_id != peer.id
-            check(bad_requester_id, "Request has wrong peer id!")
-
-            bad_start_block = lambda r: (
-                r.start < 0 or
-                r.start >= self.config.blocks_per_piece or
-                r.start > peer_pieces[peer.id][r.piece_id])
-            # Must request the _next_ necessary block
-            check(bad_start_block, "Request has bad start block!")
-
-            def piece_peer_does_not_have(r):
-                other_peer = self.peers_by_id[r.peer_id]
-                return r.piece_id not in available[other_peer.id]
-            check(piece_peer_does_not_have, "Asking for piece peer does not have!")
-            
-            # If we got here, looks ok
-
-        def available_pieces(peer_id, peer_pieces):
-            """
-            Return a list of piece ids that this peer has available.
-            """
-            return filter(lambda i: peer_pieces[peer_id][i] == conf.blocks_per_piece,
-                          range(conf.num_pieces))
-
-        def peer_done(peer_pieces, peer_id):
-            # TODO: remove linear pass
-            for blocks_so_far in peer_pieces[peer_id]:
-                if blocks_so_far < conf.blocks_per_piece:
-                    return False
-            return True
-            
-        def all_done(peer_pieces):
-            result = True
-            # Check all peers to update done status
-            for peer_id in peer_pieces:
-                if peer_done(peer_pieces, peer_id):
-                    history.peer_is_done(round, peer_id)
-                else:
-                    result = False
-            return result
-
         def create_peers():
             """Each agent class must be already loaded, and have a
-            constructor that takes the config, id,  pieces, and
-            up and down bandwidth, in that order."""
+            constructor that takes the config, id,  pieces, 
+            up and down bandwidth, in that order.  Each gets its own
+            random stream too (see make_agent)."""
 
-            def load(class_name, params):
+            def load(class_name, params, rng):
                 agent_class = conf.agent_classes[class_name]
-                return agent_class(*params)
+                return make_agent(agent_class, params, rng)
 
             counts = dict()
             def index(name):
@@ -161,239 +100,297 @@ class Sim:
             n = len(conf.agent_class_names)
             ids = map(lambda n: "%s%d" % (n,index(n)), conf.agent_class_names)
 
-            is_seed = lambda id: id.startswith("Seed")
-
-            def get_pieces(id):
-                if id.startswith("Seed"):
-                    return [conf.blocks_per_piece]*conf.num_pieces
-                else:
-                    return [0]*conf.num_pieces
-                
-            peer_pieces = dict()  # id -> list (blocks / piece)
-            peer_pieces = dict((id, get_pieces(id)) for id in ids)
-            pieces = [get_pieces(id) for id in ids]
+            pieces = [initial_pieces(conf, id) for id in ids]
             r = itertools.repeat
             
             # Re-initialize upload bandwidths at the beginning of each
             # new simulation
             up_bws = [self.up_bw(id, reinit=True) for id in ids] 
+            rngs = [random.Random(derive_seed(conf.seed, iteration, "peer", id))
+                    for id in ids]
             params = zip(r(conf), ids, pieces, up_bws)
+            specs = zip(conf.agent_class_names, params, rngs)
 
-            peers = map(load, conf.agent_class_names, params)
+            if conf.agent_workers > 1:
+                # The agents live in the worker processes.
+                return [], specs
+            peers = map(load, conf.agent_class_names, params, rngs)
             #logging.debug("Peers: \n" + "\n".join(str(p) for p in peers))
-            return peers, peer_pieces
-
-        def get_peer_requests(p, peer_info, peer_history, peer_pieces, available):
-            def remove_me(info):
-                # TODO: Do we need this linear pass?
-                return filter(lambda peer: peer.id != p.id, peer_info)
-
-            pieces = copy.copy(peer_pieces[p.id])
-            # Made copy of pieces and the peer info this peer needs to make it's
-            # decision, so that it can't change the simulation's copies.
-            p.update_pieces(pieces)
-            rs = p.requests(remove_me(peer_info), peer_history)
-            check_requests(p, rs, peer_pieces, available)
+            return peers, specs
+
+        def get_peer_requests(p, peer_info, peer_history):
+            t = times.now()
+            rs = get_requests(p, peer_info, peer_history, engine.state,
+                              engine.new_pieces, clock)
+            t = times.add("requests", t, p.__class__.__name__)
+            engine.check_requests(p.id, rs)
+            times.add("check_requests", t)
             return rs
 
-        def get_peer_uploads(all_requests, p, peer_info, peer_history):
-            def remove_me(info):
-                # TODO: remove this pass?  Use a set?
-                return filter(lambda peer: peer.id != p.id, peer_info)
-
-            def requests_to(id):
-                f = lambda r: r.peer_id == id
-                ans = []
-                for rs in all_requests.values():
-                    ans.extend(filter(f, rs))
-                return ans
-
-            requests = requests_to(p.id)
-
-            us = p.uploads(requests, remove_me(peer_info), peer_history)
-            check_uploads(p, us)
+        def get_peer_uploads(requests, p, peer_info, peer_history):
+            """requests: just the Requests addressed to p this round"""
+            t = times.now()
+            us = get_uploads(p, requests, peer_info, peer_history, clock)
+            t = times.add("uploads", t, p.__class__.__name__)
+            engine.check_uploads(p.id, us)
+            times.add("check_uploads", t)
             return us
 
-        def upload_rate(uploads, uploader_id, requester_id):
-            """
-            return the uploading rate from uploader to requester
-            in blocks per time period, or 0 if not uploading.
-            """
-            for u in uploads[uploader_id]:
-                if u.to_id == requester_id:
-                    return u.bw
-            return 0
-
-        def update_peer_pieces(peer_pieces, requests, uploads, available):
-            """
-            Process the uploads: figure out how many blocks of all the requested
-            pieces the requesters ended up with.
-            Make sure requesting the same thing from lots of peers doesn't
-            stack.
-            update the sets of available pieces as needed.
-            """
-            downloads = dict()  # peer_id -> [downloads]
-            new_pp = copy.deepcopy(peer_pieces)
-            for requester_id in requests:
-                downloads[requester_id] = list()
-            for requester_id in requests:
-                # Keep track of how many blocks of each piece this
-                # requester got.  piece -> (blocks, from_who)
-                new_blocks_per_piece = dict()
-                def update_count(piece_id, blocks, peer_id):
-                    if piece_id in new_blocks_per_piece:
-                        old = new_blocks_per_piece[piece_id][0]
-                        if blocks > old:
-                            new_blocks_per_piece[piece_id] = (blocks, peer_id)
-                    else:
-                        new_blocks_per_piece[piece_id] = (blocks, peer_id)
-
-                # Group the requests by peer that is being asked
-                get_peer_id = lambda r: r.peer_id
-                rs = sorted(requests[requester_id], key=get_peer_id)
-                for peer_id, rs_for_peer in itertools.groupby(rs, get_peer_id):
-                    bw = upload_rate(uploads, peer_id, requester_id)
-                    if bw == 0:
-                        continue
-                    # This bandwidth gets applied in order to each piece requested
-                    for r in rs_for_peer:
-                        needed_blocks = conf.blocks_per_piece - r.start
-                        alloced_bw = min(bw, needed_blocks)
-                        update_count(r.piece_id, alloced_bw, peer_id)
-                        bw -= alloced_bw
-                        if bw == 0:
-                            break
-                for piece_id in new_blocks_per_piece:
-                    (blocks, peer_id) = new_blocks_per_piece[piece_id]
-                    new_pp[requester_id][piece_id] += blocks
-                    if new_pp[requester_id][piece_id] == conf.blocks_per_piece:
-                        available[requester_id].add(piece_id)
-                    d = Download(peer_id, requester_id, piece_id, blocks)
-                    downloads[requester_id].append(d)
-                
-            return (new_pp, downloads)
-
-        def completed_pieces(peer_id, available):
-            return len(available[peer_id])
-        
-        def log_peer_info(peer_pieces, available):
-            for p_id in self.peer_ids:
-                pieces = peer_pieces[p_id]
-                logging.debug("pieces for %s: %s" % (str(p_id), str(pieces)))
-            log = ", ".join("%s:%s" % (p_id, completed_pieces(p_id, available))
-                            for p_id in self.peer_ids)
-            logging.info("Pieces completed: " + log)
-
-
-        logging.debug("Starting simulation with config: %s" % str(conf))
-
-        peers, peer_pieces = create_peers()
-        self.peer_ids = [p.id for p in peers]
-        self.peers_by_id = dict((p.id, p) for p in peers)
-        
-        upload_rates = dict((id, self.up_bw(id)) for id in self.peer_ids)
-        history = History(self.peer_ids, upload_rates)
-
-        # dict : pid -> set(finished / available pieces)
-        available = dict((pid, set(available_pieces(pid, peer_pieces)))
-                         for pid in self.peer_ids)
-
-        # Begin the event loop
-        while True:
-            logging.info("======= Round %d ========" % round)
-
-            peer_info = [PeerInfo(p.id, available[p.id])
+        def decisions():
+            """The request and upload phases, calling the agents in turn."""
+            peer_info = [PeerInfo(p.id, state.available_bits(p.id))
                          for p in peers]
             requests = dict()  # peer_id -> list of Requests
             uploads = dict()   # peer_id -> list of Uploads
             h = dict()
+            if clock is not None:
+                clock.start_round()
             for p in peers:
                 h[p.id] = history.peer_history(p.id)
-                requests[p.id] = get_peer_requests(p, peer_info, h[p.id], peer_pieces,
-                                                   available)
+                requests[p.id] = get_peer_requests(p, peer_info, h[p.id])
 
+            t = times.now()
+            requests_to = engine.route_requests(requests)
+            times.add("route_requests", t)
             for p in peers:
-                uploads[p.id] = get_peer_uploads(requests, p, peer_info, h[p.id])
-                
+                uploads[p.id] = get_peer_uploads(requests_to[p.id], p,
+                                                 peer_info, h[p.id])
+            if clock is not None:
+                self.decision_times.add_round(round, clock.spent,
+                                              clock.overran)
+            return (requests, uploads)
+
+        def pooled_decisions():
+            """The request and upload phases, with the agents in the pool."""
+            # Agent time is only seen from here, so it's timed for the
+            # pool as a whole rather than per agent class.
+            requests = dict()  # peer_id -> list of Requests
+            uploads = dict()   # peer_id -> list of Uploads
+            t = times.now()
+            results = pool.requests(round)
+            t = times.add("requests", t, "(agent pool)")
+            for pid in self.peer_ids:
+                requests[pid] = pool.result(results, pid)
+                engine.check_requests(pid, requests[pid])
+            t = times.add("check_requests", t)
+
+            requests_to = engine.route_requests(requests)
+            t = times.add("route_requests", t)
+            results = pool.uploads(requests_to)
+            t = times.add("uploads", t, "(agent pool)")
+            for pid in self.peer_ids:
+                uploads[pid] = pool.result(results, pid)
+                engine.check_uploads(pid, uploads[pid])
+            times.add("check_uploads", t)
+            if self.decision_times is not None:
+                self.decision_times.add_round(round, pool.spent, pool.overran)
+            return (requests, uploads)
+
+        def log_peer_info(state):
+            if debug_on:
+                for p_id in self.peer_ids:
+                    logging.debug("pieces for %s: %s" % (str(p_id),
+                                                         state.pieces_str(p_id)))
+            if info_on:
+                counts = state.completed_counts()
+                log = ", ".join("%s:%s" % (p_id, counts[p_id])
+                                for p_id in self.peer_ids)
+                logging.info("Pieces completed: " + log)
+
+
+        # Only build diagnostic strings someone will actually see.  Per-round
+        # diagnostics can be switched off entirely with quiet_rounds.
+        root_logger = logging.getLogger()
+        info_on = root_logger.isEnabledFor(logging.INFO)
+        debug_on = root_logger.isEnabledFor(logging.DEBUG)
+        log_rounds = not conf.quiet_rounds
+
+        logging.debug("Starting simulation with config: %s", conf)
+
+        peers, specs = create_peers()
+        self.peer_ids = [params[1] for (name, params, rng) in specs]
+        self.peers_by_id = dict((p.id, p) for p in peers)
+        
+        upload_rates = dict((id, self.up_bw(id)) for id in self.peer_ids)
 
-            (peer_pieces, downloads) = update_peer_pieces(
-                peer_pieces, requests, uploads, available)
-            history.update(downloads, uploads)
+        # Validation, transfers, swarm state and history live in the engine.
+        engine = Engine(conf, self.peer_ids, upload_rates, iteration)
+        state = engine.state
+        history = engine.history
 
-            logging.debug(history.pretty_for_round(round))
+        trace = None
+        if trace_path is not None:
+            trace = TraceWriter(trace_path, conf, self.peer_ids, upload_rates)
 
-            log_peer_info(peer_pieces, available)
-           
-            if all_done(peer_pieces):
-                logging.info("All done!")                    
-                break
-            round += 1
-            if round > conf.max_round:
-                logging.info("Out of time.  Stopping.")
-                break
-
-        logging.info("Game history:\n%s" % history.pretty())
-
-        logging.info("======== STATS ========")
-        logging.info("Uploaded blocks:\n%s" %
-                     Stats.uploaded_blocks_str(self.peer_ids, history))
-        logging.info("Completion rounds:\n%s" %
-                     Stats.completion_rounds_str(self.peer_ids, history))
-        logging.info("All done round: %s" %
-                     Stats.all_done_round(self.peer_ids, history))
+        clock = None
+        if self.decision_times is not None and conf.agent_workers <= 1:
+            clock = DecisionClock(conf.hard_budget)
+
+        pool = None
+        if conf.agent_workers > 1:
+            pool = AgentPool(conf, self.peer_ids, upload_rates, specs,
+                             conf.agent_workers)
+        times.add("setup", start)
 
+        try:
+            # Begin the event loop
+            while True:
+                if log_rounds:
+                    logging.info("======= Round %d ========", round)
+
+                if pool is not None:
+                    (requests, uploads) = pooled_decisions()
+                else:
+                    (requests, uploads) = decisions()
+
+                t = times.now()
+                delta = engine.resolve_transfers(
+                    requests, engine.transfer_rates(uploads))
+                downloads = engine.apply_delta(requests, delta)
+                t = times.add("update_peer_pieces", t)
+                history.update(downloads, uploads)
+                if pool is not None:
+                    pool.end_round(round, delta, uploads)
+                t = times.add("history_update", t)
+
+                if log_rounds:
+                    if debug_on:
+                        logging.debug(history.pretty_for_round(round))
+                    log_peer_info(state)
+                t = times.add("logging", t)
+           
+                done = engine.record_done(round)
+                t = times.add("record_done", t)
+                if trace is not None:
+                    trace.write_round(round, requests, downloads, uploads,
+                                      done)
+                    times.add("trace", t)
+
+                if engine.all_done():
+                    logging.info("All done!")                    
+                    break
+                round += 1
+                if round > conf.max_round:
+                    logging.info("Out of time.  Stopping.")
+                    break
+        finally:
+            if pool is not None:
+                pool.close()
+
+        t = times.now()
+        if trace is not None:
+            trace.close()
+            t = times.add("trace", t)
+
+        if info_on:
+            if log_rounds:
+                logging.info("Game history:\n%s" % history.pretty())
+
+            logging.info("======== STATS ========")
+            logging.info("Uploaded blocks:\n%s" %
+                         Stats.uploaded_blocks_str(self.peer_ids, history))
+            logging.info("Completion rounds:\n%s" %
+                         Stats.completion_rounds_str(self.peer_ids, history))
+            logging.info("All done round: %s" %
+                         Stats.all_done_round(self.peer_ids, history))
+            logging.info("Blocks transferred per round: %s" %
+                         Stats.throughput(history))
+        times.add("logging", t)
+
+        times.add_run(start)
         return history
 
+    def trace_path(self, i):
+        """Where iteration i's trace goes, or None if not tracing.  With
+        several iterations, each gets its own file: TRACE.0, TRACE.1, ..."""
+        path = self.config.trace
+        if not path or self.config.iters == 1:
+            return path or None
+        return "%s.%d" % (path, i)
+
+    def run_iteration(self, i):
+        """
+        Run iteration i with its own deterministic seed, and return a compact
+        summary rather than the whole History:
+        (peer_ids, uploaded blocks dict, completion rounds dict)
+        """
+        # Agents should use their own self.rng, but seed the global stream
+        # too so ones that still use the random module are repeatable.
+        random.seed(derive_seed(self.config.seed, i))
+        history = self.run_sim_once(self.trace_path(i), i)
+        return (self.peer_ids,
+                Stats.uploaded_blocks(self.peer_ids, history),
+                Stats.completion_rounds(self.peer_ids, history))
+
     def run_sim(self):
-        histories = map(lambda i: self.run_sim_once(), 
-                        range(self.config.iters))
+        """
+        Run config.iters iterations, folding each one's summary into running
+        stats as it finishes.  Every config.report_every iterations (if set),
+        log the stats so far.
+        """
+        conf = self.config
+        iters = range(conf.iters)
+        summary = SummaryStats(conf.quantiles)
+
+        pool = None
+        if conf.workers > 1:
+            pool = multiprocessing.Pool(conf.workers)
+            summaries = pool.imap(run_iteration_in_worker,
+                                  [(conf, i) for i in iters])
+        else:
+            summaries = itertools.imap(
+                lambda i: (self.run_iteration(i), None, None), iters)
+
+        try:
+            for (s, phases, decision_times) in summaries:
+                summary.add(s)
+                if phases is not None:
+                    self.phases.merge(phases)
+                if decision_times is not None:
+                    self.decision_times.merge(decision_times)
+                if (conf.report_every and summary.iters < conf.iters and
+                    summary.iters % conf.report_every == 0):
+                    logging.warning("======== INTERIM STATS (%d of %d) ========"
+                                    % (summary.iters, conf.iters))
+                    for line in summary.lines():
+                        logging.warning(line)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        self.peer_ids = summary.peer_ids
         logging.warning("======== SUMMARY STATS ========")
-        
-        uploaded_blocks = map(
-            lambda h: Stats.uploaded_blocks(self.peer_ids, h),
-            histories)
-        completion_rounds = map(
-            lambda h: Stats.completion_rounds(self.peer_ids, h),
-            histories)
-
-        def extract_by_peer_id(lst, peer_id):
-            """Given a list of dicts, pull out the entry
-            for peer_id from each dict.  Return a list"""
-            return map(lambda d: d[peer_id], lst)
-
-        uploaded_by_id = dict(
-            (p_id, extract_by_peer_id(uploaded_blocks, p_id))
-            for p_id in self.peer_ids)
-
-        completion_by_id = dict(
-            (p_id, extract_by_peer_id(completion_rounds, p_id))
-            for p_id in self.peer_ids)
-
-        logging.warning("Uploaded blocks: avg (stddev)")
-        for p_id in sorted(self.peer_ids,
-                           key=lambda id: mean(uploaded_by_id[id])):
-            us = uploaded_by_id[p_id]
-            logging.warning("%s: %.1f  (%.1f)" % (p_id, mean(us), stddev(us)))
-
-        logging.warning("Completion rounds: avg (stddev)")
-
-        def optionize(f):
-            def g(lst):
-                if None in lst:
-                    return None
-                else:
-                    return f(lst)
-            return g
+        for line in summary.lines():
+            logging.warning(line)
 
-        opt_mean = optionize(mean)
-        opt_stddev = optionize(stddev)
-        
-        for p_id in sorted(self.peer_ids,
-                           key=lambda id: opt_mean(completion_by_id[id])):
-            cs = completion_by_id[p_id]
-            logging.warning("%s: %s  (%s)" % (p_id, opt_mean(cs), opt_stddev(cs)))
+        if conf.profile_phases:
+            logging.warning("======== PHASE TIMES (%d iterations) ========"
+                            % conf.iters)
+            for line in self.phases.lines():
+                logging.warning(line)
+
+        if self.decision_times is not None:
+            logging.warning("======== DECISION TIMES (%d iterations) ========"
+                            % conf.iters)
+            for line in self.decision_times.lines():
+                logging.warning(line)
 
 
+def run_iteration_in_worker(args):
+    """
+    Pool entry point: run one iteration in a fresh Sim.  Returns its
+    summary, plus its phase times if they are being profiled and its
+    decision times if there are time budgets.
+    """
+    (config, i) = args
+    sim = Sim(config)
+    summary = sim.run_iteration(i)
+    phases = None
+    if config.profile_phases:
+        phases = sim.phases
+    return (summary, phases, sim.decision_times)
+
 
 def configure_logging(loglevel):
     numeric_level = getattr(logging, loglevel.upper(), None)
@@ -429,15 +426,10 @@ def parse_agents(args):
             
         
 
-def main(args):
+def option_parser():
     usage_msg = "Usage:  %prog [options] PeerClass1[,count] PeerClass2[,count] ..."
     parser = OptionParser(usage=usage_msg)
 
-    def usage(msg):
-        print "Error: %s\n" % msg
-        parser.print_help()
-        sys.exit()
-    
     parser.add_option("--loglevel",
                       dest="loglevel", default="info",
                       help="Set the logging level: 'debug' or 'info'")
@@ -462,10 +454,149 @@ def main(args):
                       dest="max_up_bw", default=10, type="int",
                       help="Max upload bandwidth")
 
+    parser.add_option("--trace",
+                      dest="trace", default=None,
+                      help="Write a binary trace of each run to this file "
+                      "(with --iters > 1, to FILE.0, FILE.1, ...)")
+
+    parser.add_option("--history-window",
+                      dest="history_window", default=0, type="int",
+                      help="Only keep the last K rounds of history for agents "
+                      "(0: keep everything).  Stats are unaffected")
+
+    parser.add_option("--profile-phases",
+                      dest="profile_phases", default=False,
+                      action="store_true",
+                      help="Time each phase of the sim (and each agent "
+                      "class's decisions) and print a breakdown at the end")
+
+    parser.add_option("--soft-budget",
+                      dest="soft_budget", default=0.0, type="float",
+                      help="Seconds each peer may spend on its decisions per "
+                      "round before it's counted as slow (0: no budget).  "
+                      "Prints per-peer decision latencies at the end")
+
+    parser.add_option("--hard-budget",
+                      dest="hard_budget", default=0.0, type="float",
+                      help="Seconds each peer may spend on its decisions per "
+                      "round; a decision that goes over is cut off and "
+                      "replaced by an empty one (0: no budget)")
+
+    parser.add_option("--quiet-rounds",
+                      dest="quiet_rounds", default=False, action="store_true",
+                      help="Skip the per-round diagnostics and game history")
+
+    parser.add_option("--trusted-agents",
+                      dest="trusted_agents", default=False, action="store_true",
+                      help="Only validate a sample of each agent's messages. "
+                      "For benchmarking with vetted agent classes")
+
+    parser.add_option("--validate-fraction",
+                      dest="validate_fraction", default=0.05, type="float",
+                      help="Fraction of messages validated with "
+                      "--trusted-agents")
+
+    parser.add_option("--workers",
+                      dest="workers", default=1, type="int",
+                      help="Number of processes to spread --iters across")
+
+    parser.add_option("--agent-workers",
+                      dest="agent_workers", default=1, type="int",
+                      help="Number of processes to spread the agents' "
+                      "decisions across within each round")
+
+    parser.add_option("--seed",
+                      dest="seed", default=None, type="int",
+                      help="Base RNG seed.  The sim and each peer get their "
+                      "own random stream per iteration, derived from this "
+                      "one (default: pick one at random)")
+
+    parser.add_option("--report-every",
+                      dest="report_every", default=0, type="int",
+                      help="Log interim summary stats every K iterations")
+
+    parser.add_option("--quantiles",
+                      dest="quantiles", default="",
+                      help="Comma-separated quantiles to add to the summary "
+                      "stats, e.g. '0.5,0.9'")
+
+    parser.add_option("--state-backend",
+                      dest="state_backend", default="lists",
+                      help="How the sim stores who has what: 'lists' or "
+                      "'numpy' (needs numpy)")
+
     parser.add_option("--iters",
                       dest="iters", default=1, type="int",
                       help="Number of times to run simulation to get stats")
 
+    return parser
+
+
+def check_options(options):
+    """
+    Validate parsed options.  Returns the quantiles as a list of floats;
+    raises ValueError with a message for the user if something is wrong.
+    """
+    quantiles = [float(q) for q in options.quantiles.split(",") if q]
+    if [q for q in quantiles if q < 0 or q > 1]:
+        raise ValueError("Quantiles must be between 0 and 1")
+
+    if options.history_window < 0:
+        raise ValueError("--history-window must be >= 0")
+
+    if options.validate_fraction <= 0 or options.validate_fraction > 1:
+        raise ValueError("--validate-fraction must be in (0, 1]")
+
+    if options.soft_budget < 0 or options.hard_budget < 0:
+        raise ValueError("--soft-budget and --hard-budget must be >= 0")
+
+    if options.agent_workers > 1 and options.workers > 1:
+        raise ValueError("--agent-workers and --workers can't be used together")
+
+    if options.state_backend not in BACKENDS:
+        raise ValueError("Unknown state backend: %s" % options.state_backend)
+
+    return quantiles
+
+
+def make_config(options, agents_to_run, quantiles, seed):
+    """Build the sim's Params from parsed (and checked) options."""
+    config = Params()
+
+    config.add("agent_class_names", agents_to_run)
+    config.add("agent_classes", load_modules(config.agent_class_names))
+
+    
+    config.add("num_pieces", options.num_pieces)
+    config.add("blocks_per_piece",options.blocks_per_piece)
+    config.add("max_round", options.max_round)
+    config.add("min_up_bw", options.min_up_bw)
+    config.add("max_up_bw", options.max_up_bw)
+    config.add("iters", options.iters)
+    config.add("quiet_rounds", options.quiet_rounds)
+    config.add("profile_phases", options.profile_phases)
+    config.add("soft_budget", options.soft_budget)
+    config.add("hard_budget", options.hard_budget)
+    config.add("history_window", options.history_window)
+    config.add("trace", options.trace)
+    config.add("trusted_agents", options.trusted_agents)
+    config.add("validate_fraction", options.validate_fraction)
+    config.add("state_backend", options.state_backend)
+    config.add("workers", options.workers)
+    config.add("agent_workers", options.agent_workers)
+    config.add("report_every", options.report_every)
+    config.add("quantiles", quantiles)
+    config.add("seed", seed)
+    return config
+
+
+def main(args):
+    parser = option_parser()
+
+    def usage(msg):
+        print "Error: %s\n" % msg
+        parser.print_help()
+        sys.exit()
 
     (options, args) = parser.parse_args()
 
@@ -481,26 +612,21 @@ def main(args):
         except ValueError, e:
             usage(e)
     
-    configure_logging(options.loglevel)
-    config = Params()
+    try:
+        quantiles = check_options(options)
+    except ValueError, e:
+        usage(e)
 
-    config.add("agent_class_names", agents_to_run)
-    config.add("agent_classes", load_modules(config.agent_class_names))
+    configure_logging(options.loglevel)
 
-    
-    config.add("num_pieces", options.num_pieces)
-    config.add("blocks_per_piece",options.blocks_per_piece)
-    config.add("max_round", options.max_round)
-    config.add("min_up_bw", options.min_up_bw)
-    config.add("max_up_bw", options.max_up_bw)
-    config.add("iters", options.iters)
+    seed = options.seed
+    if seed is None:
+        seed = random.SystemRandom().randint(0, 2**31 - 1)
+    logging.info("Base seed: %d" % seed)
+    config = make_config(options, agents_to_run, quantiles, seed)
     
     sim = Sim(config)
     sim.run_sim()
 
 if __name__ == "__main__":
-
-    # The next two lines are for profiling...
-    import cProfile
-    cProfile.run('main(sys.argv)', 'out.prof')
-#    main(sys.argv)
+    main(sys.argv)
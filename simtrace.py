@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+"""
+Compact, append-only binary trace of a simulation run, and a reader that
+memory-maps it so analysis scripts can scan big traces round by round.
+
+Layout (all integers little-endian):
+
+  MAGIC                    8 bytes
+  header length            uint32
+  header                   JSON: config, peer_ids, upload_rates
+
+then a sequence of records, each starting with a one-byte tag:
+
+  'I'  a new peer id, for uploads to ids that aren't peers:
+       uint32 length, utf-8 id.  Its index is the next free one after
+       peer_ids and any earlier 'I' records.
+  'R'  one round:
+       int32 round, uint32 #requests, uint32 #downloads, uint32 #uploads,
+       uint32 #done
+       requests, column by column:  requester, peer (uint32 each),
+                                    piece (int32 each), start (float64 each)
+       downloads, column by column: from, to, piece (uint32 each),
+                                    blocks (float64 each)
+       uploads, column by column:   from, to (uint32 each), bw (float64 each)
+       done: indices of peers that finished this round (uint32 each)
+
+Peers are referred to by their index in the id table.  Block counts,
+start blocks and bandwidths are stored as float64, which is exact for the
+ints the sim normally uses; the reader gives integral values back as ints.
+Requests are stored as the agents made them, in order, so replay.py can
+feed them back through the simulator core.
+
+Usage: simtrace.py TRACEFILE   -- print the stats recomputed from a trace
+"""
+
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+from messages import Request, Download, Upload
+from stats import Stats
+
+MAGIC = "BOOMTRC2"
+
+_header_len = struct.Struct("<I")
+_round_header = struct.Struct("<iIIII")
+
+
+def _column(typecode, values):
+    a = array(typecode, values)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a.tostring()
+
+
+def _read_column(typecode, buf, offset, n):
+    a = array(typecode)
+    a.fromstring(buf[offset:offset + n * a.itemsize])
+    if sys.byteorder == "big":
+        a.byteswap()
+    return (a, offset + n * a.itemsize)
+
+
+def _number(x):
+    if x == int(x):
+        return int(x)
+    return x
+
+
+def config_dict(conf):
+    """The plain-data parts of a Params config, for the trace header."""
+    d = dict()
+    for (k, v) in conf.__dict__.items():
+        if k.startswith("_") or k == "agent_classes":
+            continue
+        d[k] = v
+    return d
+
+
+class TraceWriter:
+    """Appends one run's rounds to a trace file as the sim goes."""
+    def __init__(self, path, conf, peer_ids, upload_rates):
+        self.f = open(path, "wb")
+        self.ids = peer_ids[:]
+        self.index = dict((pid, i) for (i, pid) in enumerate(peer_ids))
+        header = json.dumps({"config": config_dict(conf),
+                             "peer_ids": peer_ids,
+                             "upload_rates": upload_rates},
+                            default=str)
+        self.f.write(MAGIC)
+        self.f.write(_header_len.pack(len(header)))
+        self.f.write(header)
+
+    def _index_of(self, id):
+        if id not in self.index:
+            name = unicode(id).encode("utf-8")
+            self.f.write("I" + _header_len.pack(len(name)) + name)
+            self.index[id] = len(self.ids)
+            self.ids.append(id)
+        return self.index[id]
+
+    def write_round(self, round, reqs, dls, ups, done):
+        """
+        reqs: dict : peer_id -> [requests] -- requests made this round
+        dls: dict : peer_id -> [downloads] -- downloads for this round
+        ups: dict : peer_id -> [uploads] -- uploads for this round
+        done: [peer ids that finished this round]
+        """
+        index = self._index_of
+        rs = [r for pid in self.ids if pid in reqs for r in reqs[pid]]
+        ds = [d for pid in self.ids if pid in dls for d in dls[pid]]
+        us = [u for pid in self.ids if pid in ups for u in ups[pid]]
+        d_from = [index(d.from_id) for d in ds]
+        d_to = [index(d.to_id) for d in ds]
+        u_from = [index(u.from_id) for u in us]
+        u_to = [index(u.to_id) for u in us]
+        parts = ["R", _round_header.pack(round, len(rs), len(ds), len(us),
+                                         len(done)),
+                 _column("I", [index(r.requester_id) for r in rs]),
+                 _column("I", [index(r.peer_id) for r in rs]),
+                 _column("i", [r.piece_id for r in rs]),
+                 _column("d", [r.start for r in rs]),
+                 _column("I", d_from), _column("I", d_to),
+                 _column("I", [d.piece for d in ds]),
+                 _column("d", [d.blocks for d in ds]),
+                 _column("I", u_from), _column("I", u_to),
+                 _column("d", [u.bw for u in us]),
+                 _column("I", [self.index[pid] for pid in done])]
+        self.f.write("".join(parts))
+
+    def close(self):
+        self.f.close()
+
+
+class TraceRound:
+    """
+    One round read back from a trace.  The columns are arrays indexed
+    like the file; requests(), downloads() and uploads() build message
+    objects.
+    """
+    def __init__(self, ids, round, columns, done):
+        self.ids = ids
+        self.round = round
+        (self.req_from, self.req_to, self.req_piece, self.req_start,
+         self.dl_from, self.dl_to, self.dl_piece, self.dl_blocks,
+         self.up_from, self.up_to, self.up_bw) = columns
+        self.done = [ids[i] for i in done]
+
+    def requests(self):
+        ids = self.ids
+        return [Request(ids[self.req_from[i]], ids[self.req_to[i]],
+                        self.req_piece[i], _number(self.req_start[i]))
+                for i in xrange(len(self.req_from))]
+
+    def downloads(self):
+        ids = self.ids
+        return [Download(ids[self.dl_from[i]], ids[self.dl_to[i]],
+                         self.dl_piece[i], _number(self.dl_blocks[i]))
+                for i in xrange(len(self.dl_from))]
+
+    def uploads(self):
+        ids = self.ids
+        return [Upload(ids[self.up_from[i]], ids[self.up_to[i]],
+                       _number(self.up_bw[i]))
+                for i in xrange(len(self.up_from))]
+
+
+class TraceTotals:
+    """
+    The running totals Stats reads from a History, recomputed from a trace,
+    so the Stats functions work on either.
+    """
+    def __init__(self, peer_ids, upload_rates):
+        self.peer_ids = peer_ids[:]
+        self.upload_rates = upload_rates
+        self.round_done = dict()
+        self.uploaded = dict((pid, 0) for pid in peer_ids)
+        self.downloaded = dict((pid, 0) for pid in peer_ids)
+        self.throughput = []
+        self.done_counts = []
+
+    def add(self, r):
+        ids = r.ids
+        total = 0
+        for i in xrange(len(r.dl_from)):
+            blocks = _number(r.dl_blocks[i])
+            self.uploaded[ids[r.dl_from[i]]] += blocks
+            self.downloaded[ids[r.dl_to[i]]] += blocks
+            total += blocks
+        self.throughput.append(total)
+        for pid in r.done:
+            self.round_done.setdefault(pid, r.round)
+        self.done_counts.append(len(self.round_done))
+
+
+class TraceReader:
+    """
+    Memory-maps a trace file.  rounds() walks it one round at a time,
+    only ever holding the current round's columns.
+    """
+    def __init__(self, path):
+        self.f = open(path, "rb")
+        self.buf = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buf[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a trace file" % path)
+        offset = len(MAGIC)
+        (n,) = _header_len.unpack_from(self.buf, offset)
+        offset += _header_len.size
+        header = json.loads(self.buf[offset:offset + n])
+        self.config = header["config"]
+        self.peer_ids = [str(pid) for pid in header["peer_ids"]]
+        self.upload_rates = dict((str(k), v)
+                                 for (k, v) in header["upload_rates"].items())
+        self.start = offset + n
+
+    def rounds(self):
+        """Yield a TraceRound for each round, in order."""
+        buf = self.buf
+        ids = self.peer_ids[:]
+        offset = self.start
+        end = len(buf)
+        while offset < end:
+            tag = buf[offset]
+            offset += 1
+            if tag == "I":
+                (n,) = _header_len.unpack_from(buf, offset)
+                offset += _header_len.size
+                ids.append(buf[offset:offset + n].decode("utf-8"))
+                offset += n
+            elif tag == "R":
+                (round, n_req, n_dl, n_up,
+                 n_done) = _round_header.unpack_from(buf, offset)
+                offset += _round_header.size
+                columns = []
+                for (typecode, n) in [("I", n_req), ("I", n_req),
+                                      ("i", n_req), ("d", n_req),
+                                      ("I", n_dl), ("I", n_dl), ("I", n_dl),
+                                      ("d", n_dl), ("I", n_up), ("I", n_up),
+                                      ("d", n_up)]:
+                    (col, offset) = _read_column(typecode, buf, offset, n)
+                    columns.append(col)
+                (done, offset) = _read_column("I", buf, offset, n_done)
+                yield TraceRound(ids, round, columns, done)
+            else:
+                raise ValueError("Bad record tag %r at offset %d" %
+                                 (tag, offset - 1))
+
+    def totals(self):
+        """Scan the whole trace and return a TraceTotals for Stats."""
+        totals = TraceTotals(self.peer_ids, self.upload_rates)
+        for r in self.rounds():
+            totals.add(r)
+        return totals
+
+    def close(self):
+        self.buf.close()
+        self.f.close()
+
+
+def main(args):
+    if len(args) != 2:
+        print "Usage: simtrace.py TRACEFILE"
+        sys.exit(1)
+
+    reader = TraceReader(args[1])
+    totals = reader.totals()
+    peer_ids = reader.peer_ids
+    print "Config: %s" % reader.config
+    print "Rounds: %d" % len(totals.throughput)
+    print "Uploaded blocks:\n%s" % Stats.uploaded_blocks_str(peer_ids, totals)
+    print "Completion rounds:\n%s" % Stats.completion_rounds_str(peer_ids, totals)
+    print "All done round: %s" % Stats.all_done_round(peer_ids, totals)
+    print "Blocks transferred per round: %s" % Stats.throughput(totals)
+    reader.close()
+
+if __name__ == "__main__":
+    main(sys.argv)
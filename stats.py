@@ -1,6 +1,13 @@
 #!/usr/bin/python
 
+import math
+
+
 class Stats:
+    # History keeps running totals as the sim goes, so these are all
+    # O(peers) (or O(rounds) for the per-round series), and work with a
+    # history window too.
+
     @staticmethod
     def uploaded_blocks(peer_ids, history):
         """
@@ -10,13 +17,24 @@ class Stats:
         Returns:
         dict: peer_id -> total upload blocks used
         """
-        uploaded = dict((peer_id, 0) for peer_id in peer_ids)
-        for peer_id in peer_ids:
-            for ds in history.downloads[peer_id]:
-                for download in ds:
-                    uploaded[download.from_id] += download.blocks
-                
-        return uploaded
+        return dict((peer_id, history.uploaded[peer_id])
+                    for peer_id in peer_ids)
+
+    @staticmethod
+    def downloaded_blocks(peer_ids, history):
+        """Returns dict: peer_id -> total blocks downloaded"""
+        return dict((peer_id, history.downloaded[peer_id])
+                    for peer_id in peer_ids)
+
+    @staticmethod
+    def throughput(history):
+        """Returns [blocks transferred in the whole swarm -- one per round]"""
+        return history.throughput[:]
+
+    @staticmethod
+    def done_counts(history):
+        """Returns [number of peers done by the end of each round]"""
+        return history.done_counts[:]
 
     @staticmethod
     def uploaded_blocks_str(peer_ids, history):
@@ -49,8 +67,140 @@ class Stats:
 
     @staticmethod
     def all_done_round(peer_ids, history):
-        d = Stats.completion_rounds(peer_ids, history)
-        if None in d.values():
+        done = history.round_done
+        if len([id for id in peer_ids if id not in done]) > 0:
             return None
-        return max(d.values())
+        return max(done[id] for id in peer_ids)
     
+
+class RunningStats:
+    """
+    Running summary of one number per iteration, so the values themselves
+    needn't be kept around.  Mean and (population) variance are updated
+    with Welford's method.  None values mark missing data (e.g. a peer that
+    never finished); any missing value makes mean() and stddev() None, as
+    with the old list-based summaries.
+
+    With keep_counts, also keep a value -> count histogram for quantiles.
+    Its size is bounded by the number of distinct values (rounds, blocks),
+    not by the number of iterations.
+    """
+    def __init__(self, keep_counts=False):
+        self.n = 0
+        self.missing = 0
+        self.total = 0
+        self.running_mean = 0.0
+        self.m2 = 0.0
+        self.counts = dict() if keep_counts else None
+
+    def add(self, x):
+        if x is None:
+            self.missing += 1
+            return
+        self.n += 1
+        self.total += x
+        d = x - self.running_mean
+        self.running_mean += d / float(self.n)
+        self.m2 += d * (x - self.running_mean)
+        if self.counts is not None:
+            self.counts[x] = self.counts.get(x, 0) + 1
+
+    def merge(self, other):
+        """Fold in another RunningStats (e.g. from a worker process)."""
+        self.missing += other.missing
+        if other.n:
+            n = self.n + other.n
+            d = other.running_mean - self.running_mean
+            self.m2 += other.m2 + d * d * self.n * other.n / float(n)
+            self.running_mean += d * other.n / float(n)
+            self.total += other.total
+            self.n = n
+        if self.counts is not None and other.counts is not None:
+            for (x, c) in other.counts.items():
+                self.counts[x] = self.counts.get(x, 0) + c
+
+    def mean(self):
+        if self.missing or self.n == 0:
+            return None
+        # Same as util.mean on the full list
+        return self.total / float(self.n)
+
+    def stddev(self):
+        if self.missing or self.n == 0:
+            return None
+        return math.sqrt(max(self.m2, 0.0) / self.n)
+
+    def confidence_interval(self, z=1.96):
+        """
+        Normal-approximation interval for the mean, (low, high), using the
+        sample stddev.  None if data is missing or there are fewer than two
+        values.  z=1.96 gives 95%.
+        """
+        if self.missing or self.n < 2:
+            return None
+        half = z * math.sqrt(max(self.m2, 0.0) / (self.n - 1) / self.n)
+        m = self.mean()
+        return (m - half, m + half)
+
+    def quantile(self, q):
+        """q in [0, 1].  None if there are no counts or data is missing."""
+        if self.counts is None or self.missing or self.n == 0:
+            return None
+        rank = q * (self.n - 1)
+        seen = 0
+        for x in sorted(self.counts):
+            seen += self.counts[x]
+            if seen > rank:
+                return x
+        return x
+
+
+class SummaryStats:
+    """
+    Folds per-iteration summaries -- (peer_ids, uploaded blocks dict,
+    completion rounds dict) -- into per-peer RunningStats, so run_sim's
+    memory doesn't grow with the number of iterations.
+    """
+    def __init__(self, quantiles=None):
+        """quantiles: optional list of q in [0, 1] to report as well"""
+        self.quantiles = quantiles or []
+        self.iters = 0
+        self.peer_ids = None
+        self.uploaded = dict()    # peer_id -> RunningStats
+        self.completion = dict()  # peer_id -> RunningStats
+
+    def add(self, summary):
+        (peer_ids, uploaded, completion) = summary
+        if self.peer_ids is None:
+            self.peer_ids = peer_ids[:]
+            keep = len(self.quantiles) > 0
+            for p_id in peer_ids:
+                self.uploaded[p_id] = RunningStats(keep)
+                self.completion[p_id] = RunningStats(keep)
+        for p_id in self.peer_ids:
+            self.uploaded[p_id].add(uploaded[p_id])
+            self.completion[p_id].add(completion[p_id])
+        self.iters += 1
+
+    def _quantiles_str(self, running):
+        if not self.quantiles:
+            return ""
+        return "  [%s]" % ", ".join(
+            "q%g=%s" % (q, running.quantile(q)) for q in self.quantiles)
+
+    def lines(self):
+        """The summary, as a list of strings"""
+        ans = ["Uploaded blocks: avg (stddev)"]
+        for p_id in sorted(self.peer_ids,
+                           key=lambda id: self.uploaded[id].mean()):
+            u = self.uploaded[p_id]
+            ans.append("%s: %.1f  (%.1f)%s" % (p_id, u.mean(), u.stddev(),
+                                               self._quantiles_str(u)))
+
+        ans.append("Completion rounds: avg (stddev)")
+        for p_id in sorted(self.peer_ids,
+                           key=lambda id: self.completion[id].mean()):
+            c = self.completion[p_id]
+            ans.append("%s: %s  (%s)%s" % (p_id, c.mean(), c.stddev(),
+                                           self._quantiles_str(c)))
+        return ans
@@ -0,0 +1,338 @@
+#!/usr/bin/python
+
+"""
+The simulator's record of who has what.
+
+Two interchangeable backends:
+  - SwarmState keeps blocks-per-piece as a dict of Python int lists and
+    availability as a dict of sets.
+  - ArraySwarmState keeps blocks-per-piece as a dense peers x pieces integer
+    array and availability as a boolean matrix, so applying a round's
+    transfers, completion checks and piece counts are array operations.
+    Needs numpy.
+
+Both hand agents the same things: a fresh list of blocks per piece, a
+bitfield of available pieces for PeerInfo (see util.bitfield), and a
+read-only PieceCounts view of how many peers hold each piece.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from util import bitfield, bits_to_list, bits_has, popcount
+
+
+class PieceCounts:
+    """
+    Read-only view of the swarm's piece -> number of peers holding it
+    index.  The simulator keeps it current as peers finish pieces, so
+    rarest-first agents don't have to recount every round.
+
+    counts[piece_id] is the number of peers (including the asking agent)
+    that have piece_id available.
+    """
+    def __init__(self, counts):
+        self._counts = counts
+
+    def __getitem__(self, piece_id):
+        return int(self._counts[piece_id])
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __iter__(self):
+        return (int(c) for c in self._counts)
+
+    def __repr__(self):
+        return "PieceCounts(%s)" % list(self)
+
+
+class SwarmState:
+    """
+    peer_pieces: dict : peer_id -> [blocks / piece]
+    bits:        dict : peer_id -> bitfield of finished / available pieces
+    holders:     [number of peers that have each piece available]
+    newly_available:
+                 dict : peer_id -> [pieces that became available since
+                 pop_newly_available()], starting with what each peer has
+                 at the start
+
+    Completion is tracked incrementally: per-peer counters of blocks and
+    pieces still missing, and the set of peers that aren't done yet, are
+    updated as blocks land.
+    """
+    def __init__(self, conf, peer_ids, initial_pieces):
+        """
+        initial_pieces: dict : peer_id -> [blocks / piece] at the start
+        """
+        self.conf = conf
+        self.peer_ids = peer_ids[:]
+        self.peer_pieces = dict((pid, initial_pieces[pid][:])
+                                for pid in peer_ids)
+        full = dict((pid, self._full_pieces(pid)) for pid in peer_ids)
+        self.bits = dict((pid, bitfield(full[pid])) for pid in peer_ids)
+        self.holders = [0] * conf.num_pieces
+        for pid in peer_ids:
+            for piece_id in full[pid]:
+                self.holders[piece_id] += 1
+        self.piece_counts = PieceCounts(self.holders)
+        self._init_newly_available()
+        self._init_progress()
+
+    def _init_newly_available(self):
+        self.newly_available = dict((pid, bits_to_list(self.bits[pid]))
+                                    for pid in self.peer_ids
+                                    if self.bits[pid])
+
+    def _full_pieces(self, peer_id):
+        """
+        Return a list of piece ids that this peer has available.
+        """
+        bpp = self.conf.blocks_per_piece
+        pieces = self.peer_pieces[peer_id]
+        return [i for i in range(self.conf.num_pieces) if pieces[i] == bpp]
+
+    def _init_progress(self):
+        self.remaining_blocks = dict()  # peer_id -> blocks still needed
+        self.remaining_pieces = dict()  # peer_id -> pieces not yet complete
+        self.incomplete = set()         # peers still missing something
+        self.newly_done = []            # finished since pop_newly_done()
+        bpp = self.conf.blocks_per_piece
+        for peer_id in self.peer_ids:
+            pieces = self.peer_pieces[peer_id]
+            self.remaining_blocks[peer_id] = sum(
+                max(bpp - b, 0) for b in pieces)
+            self.remaining_pieces[peer_id] = len(
+                [b for b in pieces if b < bpp])
+            self._check_done(peer_id)
+
+    def _check_done(self, peer_id):
+        if self.peer_done(peer_id):
+            self.incomplete.discard(peer_id)
+            self.newly_done.append(peer_id)
+        else:
+            self.incomplete.add(peer_id)
+
+    def pieces(self, peer_id):
+        """A copy of peer_id's blocks per piece, safe to hand to an agent."""
+        return self.peer_pieces[peer_id][:]
+
+    def blocks(self, peer_id, piece_id):
+        return self.peer_pieces[peer_id][piece_id]
+
+    def has_piece(self, peer_id, piece_id):
+        return bits_has(self.bits[peer_id], piece_id)
+
+    def available_bits(self, peer_id):
+        """The bitfield of finished pieces, as shown to agents in PeerInfo."""
+        return self.bits[peer_id]
+
+    def completed_counts(self):
+        """dict : peer_id -> number of finished pieces"""
+        return dict((pid, popcount(self.bits[pid])) for pid in self.peer_ids)
+
+    def peer_done(self, peer_id):
+        return self.remaining_pieces[peer_id] == 0
+
+    def all_done(self):
+        return len(self.incomplete) == 0
+
+    def pop_newly_done(self):
+        """Return the peers that finished since the last call."""
+        done = self.newly_done
+        self.newly_done = []
+        return done
+
+    def pop_newly_available(self):
+        """
+        Return dict : peer_id -> [pieces that became available since the
+        last call], in increasing order.  Only peers with new pieces are
+        in it.
+        """
+        new = self.newly_available
+        self.newly_available = dict()
+        for pieces in new.values():
+            pieces.sort()
+        return new
+
+    def apply(self, delta):
+        """
+        delta: [(requester_id, [(piece_id, blocks, from_who)])], see
+               Engine.resolve_transfers
+
+        Add the blocks in place and update the bitfields of available
+        pieces and completion counters as needed.
+        """
+        bpp = self.conf.blocks_per_piece
+        for (requester_id, transfers) in delta:
+            pieces = self.peer_pieces[requester_id]
+            for (piece_id, blocks, from_who) in transfers:
+                old_blocks = pieces[piece_id]
+                pieces[piece_id] += blocks
+                # Available means exactly bpp blocks, and blocks only go up.
+                if pieces[piece_id] == bpp and old_blocks != bpp:
+                    self.bits[requester_id] |= 1L << piece_id
+                    self.newly_available.setdefault(requester_id,
+                                                    []).append(piece_id)
+                    self.holders[piece_id] += 1
+                if old_blocks < bpp:
+                    self.remaining_blocks[requester_id] -= (
+                        min(pieces[piece_id], bpp) - old_blocks)
+                    if pieces[piece_id] >= bpp:
+                        self.remaining_pieces[requester_id] -= 1
+                        if self.peer_done(requester_id):
+                            self._check_done(requester_id)
+
+    def pieces_str(self, peer_id):
+        return str(self.peer_pieces[peer_id])
+
+
+class ArraySwarmState(SwarmState):
+    """
+    blocks_arr: numpy int array, peers x pieces -- blocks / piece
+    have:       numpy bool array, peers x pieces -- finished / available pieces
+    bits:       dict : peer_id -> bitfield of the same pieces, for PeerInfo
+
+    Rows follow the order of peer_ids.
+
+    Agents may upload fractional bandwidth.  The list backend then ends up
+    with float entries, which agents can tell apart (e.g. integer division),
+    so once that happens the matrix switches to floats and `fractional`
+    remembers which cells the list backend would hold as floats.
+    """
+    def __init__(self, conf, peer_ids, initial_pieces):
+        if numpy is None:
+            raise ImportError("The numpy state backend needs numpy installed")
+        self.conf = conf
+        self.peer_ids = peer_ids[:]
+        self.row = dict((pid, i) for (i, pid) in enumerate(peer_ids))
+        self.blocks_arr = numpy.array([initial_pieces[pid] for pid in peer_ids],
+                                      dtype=numpy.int64).reshape(
+            len(peer_ids), conf.num_pieces)
+        self.fractional = None
+        self.have = self.blocks_arr == conf.blocks_per_piece
+        self.bits = dict(
+            (pid, bitfield(int(i) for i in
+                           numpy.flatnonzero(self.have[self.row[pid]])))
+            for pid in peer_ids)
+        self.holders = self.have.sum(axis=0)
+        self.piece_counts = PieceCounts(self.holders)
+        self._init_newly_available()
+        self._init_progress()
+
+    def _init_progress(self):
+        bpp = self.conf.blocks_per_piece
+        self.remaining_blocks_arr = numpy.maximum(
+            bpp - self.blocks_arr, 0).sum(axis=1)
+        self.remaining_pieces_arr = (self.blocks_arr < bpp).sum(axis=1)
+        self.incomplete = set()
+        self.newly_done = []
+        for peer_id in self.peer_ids:
+            self._check_done(peer_id)
+
+    @property
+    def remaining_blocks(self):
+        return dict((pid, self.remaining_blocks_arr[self.row[pid]].item())
+                    for pid in self.peer_ids)
+
+    @property
+    def remaining_pieces(self):
+        return dict((pid, int(self.remaining_pieces_arr[self.row[pid]]))
+                    for pid in self.peer_ids)
+
+    def _go_fractional(self):
+        self.blocks_arr = self.blocks_arr.astype(numpy.float64)
+        self.remaining_blocks_arr = self.remaining_blocks_arr.astype(
+            numpy.float64)
+        self.fractional = numpy.zeros(self.blocks_arr.shape, dtype=bool)
+
+    def pieces(self, peer_id):
+        i = self.row[peer_id]
+        row = self.blocks_arr[i].tolist()
+        if self.fractional is None:
+            return row
+        return [b if f else int(b)
+                for (b, f) in zip(row, self.fractional[i].tolist())]
+
+    def blocks(self, peer_id, piece_id):
+        i = self.row[peer_id]
+        b = self.blocks_arr[i, piece_id].item()
+        if self.fractional is None or self.fractional[i, piece_id]:
+            return b
+        return int(b)
+
+    def has_piece(self, peer_id, piece_id):
+        return bool(self.have[self.row[peer_id], piece_id])
+
+    def completed_counts(self):
+        counts = self.have.sum(axis=1)
+        return dict((pid, int(counts[self.row[pid]])) for pid in self.peer_ids)
+
+    def peer_done(self, peer_id):
+        return self.remaining_pieces_arr[self.row[peer_id]] == 0
+
+    def apply(self, delta):
+        bpp = self.conf.blocks_per_piece
+        # Flatten the delta into (row, piece, blocks) columns, in the same
+        # order the list backend walks it.
+        requester_ids = []
+        pieces = []
+        added = []
+        for (requester_id, transfers) in delta:
+            for (piece_id, blocks, from_who) in transfers:
+                requester_ids.append(requester_id)
+                pieces.append(piece_id)
+                added.append(blocks)
+        if not pieces:
+            return
+        rows = numpy.array([self.row[pid] for pid in requester_ids])
+        cols = numpy.array(pieces)
+
+        is_float = numpy.array([type(b) is float for b in added])
+        if self.fractional is None and is_float.any():
+            self._go_fractional()
+        if self.fractional is not None:
+            self.fractional[rows[is_float], cols[is_float]] = True
+        added = numpy.array(added, dtype=self.blocks_arr.dtype)
+
+        # Each (requester, piece) shows up at most once in a delta, so plain
+        # fancy indexing is safe here.
+        old = self.blocks_arr[rows, cols]
+        new = old + added
+        self.blocks_arr[rows, cols] = new
+
+        full = (new == bpp) & ~self.have[rows, cols]
+        self.have[rows[full], cols[full]] = True
+        numpy.add.at(self.holders, cols[full], 1)
+        for k in numpy.flatnonzero(full):
+            self.bits[requester_ids[k]] |= 1L << pieces[k]
+            self.newly_available.setdefault(requester_ids[k],
+                                            []).append(pieces[k])
+
+        counted = old < bpp
+        numpy.subtract.at(self.remaining_blocks_arr, rows[counted],
+                          numpy.minimum(new[counted], bpp) - old[counted])
+        finished = counted & (new >= bpp)
+        numpy.subtract.at(self.remaining_pieces_arr, rows[finished], 1)
+
+        for k in numpy.flatnonzero(finished):
+            requester_id = requester_ids[k]
+            if requester_id in self.incomplete and self.peer_done(requester_id):
+                self._check_done(requester_id)
+
+    def pieces_str(self, peer_id):
+        return str(self.pieces(peer_id))
+
+
+BACKENDS = {
+    "lists": SwarmState,
+    "numpy": ArraySwarmState,
+    }
+
+
+def make_swarm_state(backend, conf, peer_ids, initial_pieces):
+    if backend not in BACKENDS:
+        raise ValueError("Unknown state backend: %s" % backend)
+    return BACKENDS[backend](conf, peer_ids, initial_pieces)
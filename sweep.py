@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+"""
+Runs the sim over a grid (or list) of configurations and writes a tidy
+results table: one row per cell, iteration and peer.
+
+The grid is a JSON file.  A dict is a grid: every list-valued key is
+swept over (all combinations), everything else is fixed.  A list of such
+dicts is a list of grids, run one after another.  Keys are sim.py's long
+option names (with - or _) or their dest names, plus "agents", a string
+of agent classes as on the sim.py command line.  For example
+
+  {"agents": ["Dummy,4 Seed", "BoomerStd,4 Seed"],
+   "num-pieces": [10, 20, 40], "min-bw": 4, "max-bw": [8, 16]}
+
+Each iteration's result is cached in --cache-dir, keyed by the cell's
+config, its seed, the iteration number and a hash of the source of the
+agent classes it uses.  Rerunning a sweep only runs what's missing, so an
+interrupted sweep picks up where it stopped.
+
+Usage: sweep.py [options] GRIDFILE
+"""
+
+import os
+import sys
+import csv
+import json
+import inspect
+import hashlib
+import logging
+import tempfile
+import itertools
+import multiprocessing
+from optparse import OptionParser
+
+import sim
+from simtrace import config_dict
+
+# Bump to invalidate every cached result, e.g. when the core's semantics
+# change.
+CACHE_VERSION = 1
+
+# Options that change how a run is carried out or reported, but not its
+# results.
+RUN_CONTROLS = set(["iters", "workers", "agent_workers", "report_every",
+                    "quantiles", "trace", "quiet_rounds", "profile_phases",
+                    "soft_budget"])
+
+
+def expand(grid):
+    """The list of cells (dicts) a grid or list of grids stands for."""
+    if isinstance(grid, list):
+        return [cell for g in grid for cell in expand(g)]
+    keys = sorted(grid)
+    values = [v if isinstance(v, list) else [v] for v in (grid[k] for k in keys)]
+    return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+
+
+def option_dest(parser, key):
+    """Map a grid key (long option name or dest) to the option's dest."""
+    name = "--" + key.replace("_", "-")
+    if parser.has_option(name):
+        return parser.get_option(name).dest
+    for option in parser.option_list:
+        if option.dest == key:
+            return key
+    raise ValueError("Unknown grid key: %s" % key)
+
+
+def make_config(parser, cell, seed):
+    """
+    Build the sim config for a cell.  Options the cell doesn't set keep
+    sim.py's defaults.
+    """
+    options = parser.get_default_values()
+    agents = None
+    for (k, v) in cell.items():
+        if k == "agents":
+            agents = sim.parse_agents(str(v).split())
+        else:
+            setattr(options, option_dest(parser, k), v)
+    if agents is None:
+        raise ValueError("Cell has no agents: %s" % cell)
+    if options.seed is None:
+        options.seed = seed
+    quantiles = sim.check_options(options)
+    config = sim.make_config(options, agents, quantiles, options.seed)
+    # Each run is one task in the sweep's own pool.
+    config.add("iters", 1)
+    config.add("workers", 1)
+    config.add("agent_workers", 1)
+    config.add("trace", None)
+    config.add("quiet_rounds", True)
+    return config
+
+
+def agent_source_hash(agent_classes):
+    """md5 of the source of every module the agent classes are built from."""
+    files = set()
+    for cls in agent_classes.values():
+        for c in inspect.getmro(cls):
+            try:
+                f = inspect.getsourcefile(sys.modules[c.__module__])
+            except TypeError:
+                # Built in (object, for new-style classes): no source.
+                continue
+            if f is not None:
+                files.add(os.path.abspath(f))
+    h = hashlib.md5()
+    for f in sorted(files):
+        h.update(open(f, "rb").read())
+    return h.hexdigest()
+
+
+def cache_key(config, i, source_hash):
+    d = dict((k, v) for (k, v) in config_dict(config).items()
+             if k not in RUN_CONTROLS)
+    d["iteration"] = i
+    d["agent_source"] = source_hash
+    d["cache_version"] = CACHE_VERSION
+    return hashlib.md5(json.dumps(d, sort_keys=True, default=str)).hexdigest()
+
+
+class ResultCache:
+    """One JSON file per finished run, written atomically."""
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def get(self, key):
+        try:
+            f = open(self._file(key))
+        except IOError:
+            return None
+        try:
+            (peer_ids, uploaded, completion) = json.load(f)
+        finally:
+            f.close()
+        peer_ids = [str(pid) for pid in peer_ids]
+        return (peer_ids,
+                dict((str(k), v) for (k, v) in uploaded.items()),
+                dict((str(k), v) for (k, v) in completion.items()))
+
+    def put(self, key, summary):
+        (fd, tmp) = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        f = os.fdopen(fd, "w")
+        try:
+            json.dump(summary, f)
+        finally:
+            f.close()
+        os.rename(tmp, self._file(key))
+
+
+def run_task(args):
+    """Pool entry point: (key, config, i) -> (key, summary)"""
+    (key, config, i) = args
+    return (key, sim.Sim(config).run_iteration(i))
+
+
+def table_rows(cells, configs, keys, cache, columns):
+    """Tidy rows: one per cell, iteration and peer."""
+    for (n, (cell, config)) in enumerate(zip(cells, configs)):
+        params = [cell.get(c, "") for c in columns]
+        for (i, key) in enumerate(keys[n]):
+            (peer_ids, uploaded, completion) = cache.get(key)
+            for (pid, agent_class) in zip(peer_ids, config.agent_class_names):
+                c = completion[pid]
+                yield ([n] + params +
+                       [config.seed, i, pid, agent_class, uploaded[pid],
+                        "" if c is None else c])
+
+
+def main(args):
+    parser = OptionParser(usage="Usage: %prog [options] GRIDFILE")
+    parser.add_option("--iters",
+                      dest="iters", default=1, type="int",
+                      help="Iterations per cell")
+    parser.add_option("--seed",
+                      dest="seed", default=0, type="int",
+                      help="Base seed for cells that don't set their own")
+    parser.add_option("--workers",
+                      dest="workers", default=1, type="int",
+                      help="Number of processes to run the sweep with")
+    parser.add_option("--cache-dir",
+                      dest="cache_dir", default="sweep-cache",
+                      help="Where finished runs are cached")
+    parser.add_option("--out",
+                      dest="out", default="sweep.tsv",
+                      help="Where to write the results table (tab-separated)")
+    parser.add_option("--loglevel",
+                      dest="loglevel", default="warning",
+                      help="Set the logging level")
+    (options, args) = parser.parse_args(args[1:])
+    if len(args) != 1:
+        parser.print_help()
+        sys.exit(1)
+
+    sim.configure_logging(options.loglevel)
+    sim_parser = sim.option_parser()
+    try:
+        # Name the columns after the options' dests, however the grid
+        # spells them.
+        cells = [dict((k if k == "agents" else option_dest(sim_parser, k), v)
+                      for (k, v) in cell.items())
+                 for cell in expand(json.load(open(args[0])))]
+        configs = [make_config(sim_parser, cell, options.seed)
+                   for cell in cells]
+    except ValueError, e:
+        parser.error(str(e))
+
+    cache = ResultCache(options.cache_dir)
+    keys = []
+    for config in configs:
+        source_hash = agent_source_hash(config.agent_classes)
+        keys.append([cache_key(config, i, source_hash)
+                     for i in range(options.iters)])
+    tasks = [(key, config, i)
+             for (config, ks) in zip(configs, keys)
+             for (i, key) in enumerate(ks)
+             if cache.get(key) is None]
+    total = len(cells) * options.iters
+    logging.warning("%d cells, %d runs: %d cached, %d to run" % (
+        len(cells), total, total - len(tasks), len(tasks)))
+
+    pool = None
+    if options.workers > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(options.workers)
+        results = pool.imap_unordered(run_task, tasks)
+    else:
+        results = itertools.imap(run_task, tasks)
+    try:
+        for (done, (key, summary)) in enumerate(results):
+            cache.put(key, summary)
+            logging.info("Finished run %d of %d" % (done + 1, len(tasks)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    columns = ["agents"] + sorted(set(k for cell in cells for k in cell) -
+                                  set(["agents", "seed"]))
+    out = open(options.out, "wb")
+    writer = csv.writer(out, delimiter="\t", lineterminator="\n")
+    writer.writerow(["cell"] + columns +
+                    ["seed", "iter", "peer", "agent_class",
+                     "uploaded_blocks", "completion_round"])
+    for row in table_rows(cells, configs, keys, cache, columns):
+        writer.writerow(row)
+    out.close()
+    logging.warning("Results written to %s" % options.out)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+
+# Running the agents in worker processes (--agent-workers) must not change
+# what they see, so it must not change the results either.
+#
+# Run with: python -m unittest test_agentpool
+
+import logging
+import random
+import unittest
+
+import sim
+from messages import Request
+from deltadummy import DeltaDummy
+from test_swarm import summary
+
+
+class OrderedDelta(DeltaDummy):
+    """
+    A delta agent that asks for the pieces it heard about most recently
+    first, in the order RoundChanges.new_pieces and .downloads list them,
+    so any difference in that order shows up in the results.
+    """
+    def post_init(self):
+        DeltaDummy.post_init(self)
+        self.heard = []
+
+    def requests_delta(self, changes):
+        for peer_id in sorted(changes.new_pieces):
+            self.heard.extend(changes.new_pieces[peer_id])
+        self.heard.extend(d.piece for d in changes.downloads)
+        for (peer_id, pieces) in changes.new_pieces.items():
+            if peer_id != self.id:
+                self.available.setdefault(peer_id, set()).update(pieces)
+
+        bpp = self.conf.blocks_per_piece
+        requests = []
+        for peer_id in sorted(self.available):
+            wanted = []
+            for i in reversed(self.heard):
+                if (self.pieces[i] < bpp and i in self.available[peer_id]
+                    and i not in wanted):
+                    wanted.append(i)
+            for piece_id in wanted[:self.max_requests]:
+                requests.append(Request(self.id, peer_id, piece_id,
+                                        self.pieces[piece_id]))
+        return requests
+
+
+def run(agent_workers, seed=3):
+    names = ['OrderedDelta'] * 4 + ['Dummy'] * 2 + ['BoomerTyrant', 'Seed']
+    parser = sim.option_parser()
+    (options, args) = parser.parse_args(
+        ["--num-pieces", "40", "--blocks-per-piece", "4",
+         "--max-round", "150", "--agent-workers", str(agent_workers)])
+    quantiles = sim.check_options(options)
+    config = sim.make_config(options, ['Dummy', 'BoomerTyrant', 'Seed'],
+                             quantiles, seed)
+    config.agent_class_names = names
+    config.agent_classes['OrderedDelta'] = OrderedDelta
+    random.seed(seed)
+    return sim.Sim(config).run_sim_once()
+
+
+class TestAgentPool(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_same_history_as_serial(self):
+        serial = summary(run(1))
+        self.assertEqual(serial, summary(run(2)))
+        self.assertEqual(serial, summary(run(3)))
+
+
+if __name__ == "__main__":
+    unittest.main()
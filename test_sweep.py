@@ -0,0 +1,40 @@
+#!/usr/bin/python
+
+# Run with: python -m unittest test_sweep
+
+import os
+import sys
+import hashlib
+import unittest
+
+import sweep
+from dummy import Dummy
+
+
+class NewStyleAgent(object):
+    pass
+
+
+class TestAgentSourceHash(unittest.TestCase):
+    def source_md5(self, *modules):
+        h = hashlib.md5()
+        files = [os.path.splitext(m.__file__)[0] + ".py" for m in modules]
+        for f in sorted(os.path.abspath(f) for f in files):
+            h.update(open(f, "rb").read())
+        return h.hexdigest()
+
+    def test_new_style_agent(self):
+        # object is in the MRO, and has no source file.
+        self.assertEqual(
+            sweep.agent_source_hash({"NewStyleAgent": NewStyleAgent}),
+            self.source_md5(sys.modules[__name__]))
+
+    def test_includes_base_classes(self):
+        import dummy
+        import peer
+        self.assertEqual(sweep.agent_source_hash({"Dummy": Dummy}),
+                         self.source_md5(dummy, peer))
+
+
+if __name__ == "__main__":
+    unittest.main()
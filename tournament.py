@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+"""
+Round-robin tournament between agent classes.
+
+Every pair of classes meets in its own swarm, and (with three or more
+classes) all of them meet in one mixed swarm, once for each Seed count
+given.  Every matchup runs the same iterations with the same seeds, and
+the runs are spread over a process pool.
+
+Each class is then ranked by its peers' completion round (lower is
+better) and uploaded blocks, with 95% confidence intervals.  A run
+contributes one value per class: the mean over that class's peers in the
+run.  Peers that never finish count as finishing at max_round + 1, and
+the share that finished is reported alongside.
+
+Usage: tournament.py [options] AgentClass1 AgentClass2 ...
+"""
+
+import sys
+import json
+import logging
+import itertools
+import multiprocessing
+from optparse import OptionParser
+
+import sim
+import sweep
+from stats import RunningStats
+
+
+def matchups(classes, copies, seed_counts):
+    """
+    The tournament's populations, as agent strings for sim.parse_agents:
+    every pair, then everyone, for each Seed count.
+    """
+    groups = [list(pair) for pair in itertools.combinations(classes, 2)]
+    if len(classes) > 2:
+        groups.append(list(classes))
+    return [" ".join(["%s,%d" % (c, copies) for c in group] +
+                     ["Seed,%d" % seeds])
+            for seeds in seed_counts
+            for group in groups]
+
+
+def parse_settings(settings):
+    """--set KEY=VALUE options, with JSON values where they parse."""
+    cell = dict()
+    for s in settings:
+        if "=" not in s:
+            raise ValueError("--set needs KEY=VALUE: %s" % s)
+        (k, v) = s.split("=", 1)
+        try:
+            v = json.loads(v)
+        except ValueError:
+            pass
+        cell[k] = v
+    return cell
+
+
+class ClassScores:
+    """Running stats for one agent class across the whole tournament."""
+    def __init__(self):
+        self.completion = RunningStats()
+        self.uploaded = RunningStats()
+        self.peers = 0
+        self.finished = 0
+
+    def add(self, completions, uploads, max_round):
+        """completions, uploads: the class's peers' values in one run"""
+        self.peers += len(completions)
+        self.finished += len([c for c in completions if c is not None])
+        censored = [max_round + 1 if c is None else c for c in completions]
+        self.completion.add(sum(censored) / float(len(censored)))
+        self.uploaded.add(sum(uploads) / float(len(uploads)))
+
+
+def by_class(summary, class_names):
+    """Split one run's summary into class -> ([completions], [uploads])."""
+    (peer_ids, uploaded, completion) = summary
+    ans = dict()
+    for (pid, c) in zip(peer_ids, class_names):
+        (cs, us) = ans.setdefault(c, ([], []))
+        cs.append(completion[pid])
+        us.append(uploaded[pid])
+    return ans
+
+
+def interval_str(running):
+    ci = running.confidence_interval()
+    if ci is None:
+        return "%.2f" % running.mean()
+    return "%.2f  [%.2f, %.2f]" % (running.mean(), ci[0], ci[1])
+
+
+def ranking_lines(title, scores, key, reverse):
+    ans = [title]
+    ranked = sorted(scores, key=lambda c: key(scores[c]).mean(),
+                    reverse=reverse)
+    for (rank, c) in enumerate(ranked):
+        s = scores[c]
+        ans.append("%2d. %-20s %-28s finished %5.1f%%  (%d runs)" % (
+            rank + 1, c, interval_str(key(s)),
+            100.0 * s.finished / s.peers, key(s).n))
+    return ans
+
+
+def main(args):
+    parser = OptionParser(
+        usage="Usage: %prog [options] AgentClass1 AgentClass2 ...")
+    parser.add_option("--copies",
+                      dest="copies", default=2, type="int",
+                      help="Peers of each class in every matchup")
+    parser.add_option("--seeds",
+                      dest="seeds", default="1",
+                      help="Comma-separated Seed counts; every matchup is "
+                      "played once with each")
+    parser.add_option("--iters",
+                      dest="iters", default=10, type="int",
+                      help="Runs per matchup")
+    parser.add_option("--seed",
+                      dest="seed", default=0, type="int",
+                      help="Base seed, shared by every matchup")
+    parser.add_option("--workers",
+                      dest="workers", default=1, type="int",
+                      help="Number of processes to run the tournament with")
+    parser.add_option("--set",
+                      dest="settings", default=[], action="append",
+                      help="Set a sim option for every matchup, e.g. "
+                      "--set num-pieces=20 (repeatable)")
+    parser.add_option("--loglevel",
+                      dest="loglevel", default="warning",
+                      help="Set the logging level")
+    (options, args) = parser.parse_args(args[1:])
+    classes = list(args)
+    if len(classes) < 2:
+        parser.error("Need at least two agent classes")
+    if len(set(classes)) != len(classes):
+        parser.error("Agent classes must be distinct")
+    if "Seed" in classes:
+        parser.error("Seeds are added with --seeds")
+
+    sim.configure_logging(options.loglevel)
+    sim_parser = sim.option_parser()
+    try:
+        seed_counts = [int(n) for n in options.seeds.split(",")]
+        settings = parse_settings(options.settings)
+        populations = matchups(classes, options.copies, seed_counts)
+        configs = []
+        for agents in populations:
+            cell = dict(settings)
+            cell["agents"] = agents
+            configs.append(sweep.make_config(sim_parser, cell, options.seed))
+    except ValueError, e:
+        parser.error(str(e))
+
+    tasks = [(m, config, i)
+             for (m, config) in enumerate(configs)
+             for i in range(options.iters)]
+    logging.warning("%d matchups, %d runs" % (len(configs), len(tasks)))
+
+    pool = None
+    if options.workers > 1:
+        pool = multiprocessing.Pool(options.workers)
+        results = pool.imap(sweep.run_task, tasks)
+    else:
+        results = itertools.imap(sweep.run_task, tasks)
+
+    scores = dict((c, ClassScores()) for c in classes)
+    per_matchup = [dict((c, ClassScores())
+                        for c in set(config.agent_class_names) if c != "Seed")
+                   for config in configs]
+    try:
+        for (m, summary) in results:
+            config = configs[m]
+            for (c, (cs, us)) in by_class(summary,
+                                          config.agent_class_names).items():
+                if c == "Seed":
+                    continue
+                scores[c].add(cs, us, config.max_round)
+                per_matchup[m][c].add(cs, us, config.max_round)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    print "======== MATCHUPS: completion round / uploaded blocks ========"
+    for (agents, matchup) in zip(populations, per_matchup):
+        print "%s:  %s" % (agents, ", ".join(
+            "%s %.1f / %.1f" % (c, matchup[c].completion.mean(),
+                                matchup[c].uploaded.mean())
+            for c in classes if c in matchup))
+    print
+    for line in ranking_lines(
+        "======== RANKING: completion round (lower is better) ========",
+        scores, lambda s: s.completion, False):
+        print line
+    print
+    for line in ranking_lines(
+        "======== RANKING: uploaded blocks (higher is better) ========",
+        scores, lambda s: s.uploaded, True):
+        print line
+
+if __name__ == "__main__":
+    main(sys.argv)
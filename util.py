@@ -6,6 +6,8 @@
 
 from itertools import imap, izip, count
 import math
+import hashlib
+import inspect
 
 
 def argmax(pairs):
@@ -86,6 +88,95 @@ def even_split(n, k):
     return ans
 
 
+def derive_seed(*parts):
+    """
+    Deterministically derive an RNG seed from any number of parts (ints,
+    strings), e.g. derive_seed(base_seed, iteration).  Different parts give
+    unrelated seeds; the same parts always give the same one.
+    """
+    key = "/".join(str(p) for p in parts)
+    return int(hashlib.md5(key).hexdigest()[:16], 16)
+
+
+# Bitfields ################
+#
+# A set of piece ids as a Python long with bit i set for piece i, like the
+# bitfield message in the real protocol.  PeerInfo.bitfield is one.
+
+def bitfield(pieces):
+    """
+    The bitfield for an iterable of piece ids.  Sets one byte per piece in
+    a string of binary digits and converts it once, so this is linear in
+    the number of pieces.
+
+    >>> bitfield([0, 3, 5]) == 0b101001
+    True
+    """
+    pieces = list(pieces)
+    if not pieces:
+        return 0L
+    digits = bytearray("0") * (max(pieces) + 1)
+    for i in pieces:
+        digits[i] = "1"
+    digits.reverse()
+    return long(str(digits), 2)
+
+def bits_intersect(a, b):
+    """Pieces in both bitfields"""
+    return a & b
+
+def bits_difference(a, b):
+    """Pieces in bitfield a but not in b"""
+    return a & ~b
+
+def popcount(bits):
+    """Number of pieces in a bitfield"""
+    return bin(bits).count("1")
+
+def bits_has(bits, i):
+    return (bits >> i) & 1 == 1
+
+def bits_below(counts, limit):
+    """
+    The bitfield of the indices i with counts[i] < limit -- e.g. the pieces
+    an agent still needs, from its blocks per piece.  For small int counts
+    (the usual case) this is done in C, through a translation table.
+
+    >>> bits_below([4, 0, 2, 4], 4) == bitfield([1, 2])
+    True
+    """
+    if 0 < limit <= 256:
+        try:
+            digits = bytearray(counts)
+        except (TypeError, ValueError):
+            pass   # fractional blocks, or a count outside 0..255
+        else:
+            digits.reverse()
+            table = "1" * limit + "0" * (256 - limit)
+            return long(str(digits).translate(table) or "0", 2)
+    return bitfield(i for (i, c) in enumerate(counts) if c < limit)
+
+def bits_to_list(bits):
+    """
+    The piece ids in a bitfield, in increasing order.  The digits are
+    scanned in C, so the Python-level work is one step per piece.
+
+    >>> bits_to_list(bitfield([5, 0, 3]))
+    [0, 3, 5]
+    >>> bits_to_list(0)
+    []
+    """
+    # Reversed, so digit i is bit i; the "0b" prefix is sliced off.
+    digits = bin(bits)[:1:-1]
+    ans = []
+    find = digits.find
+    i = find("1")
+    while i >= 0:
+        ans.append(i)
+        i = find("1", i + 1)
+    return ans
+
+
 def load_modules(agent_classes):
     """Each agent class must be in module class_name.lower().
     Returns a dictionary class_name->class"""
@@ -97,7 +188,27 @@ def load_modules(agent_classes):
         return (class_name, agent_class)
 
     return dict(map(load, agent_classes))
-    
+
+
+def make_agent(agent_class, params, rng):
+    """
+    Construct an agent from params -- (config, id, init_pieces,
+    up_bandwidth) -- and give it its random stream.  Agents whose
+    __init__ takes rng get it as a keyword, so it's there in post_init();
+    agents with the older four-argument __init__ get self.rng set right
+    after construction.
+    """
+    try:
+        spec = inspect.getargspec(agent_class.__init__)
+        takes_rng = "rng" in spec.args or spec.keywords is not None
+    except (AttributeError, TypeError):
+        takes_rng = False
+    if takes_rng:
+        return agent_class(*params, rng=rng)
+    agent = agent_class(*params)
+    agent.rng = rng
+    return agent
+
 
 
 class Params:
@@ -118,3 +229,11 @@ class IllegalUpload(Exception):
 class IllegalRequest(Exception):
     pass
 
+class RoundNotInHistory(IndexError):
+    pass
+
+class ReplayMismatch(Exception):
+    pass
+
+class DecisionTimeout(Exception):
+    pass